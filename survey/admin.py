@@ -1,4 +1,4 @@
-from survey.models import Answer, Choice, Question, Survey
+from survey.models import Answer, Choice, Interview, Question, Survey
 from django.contrib import admin
 
 class ChoiceInline(admin.TabularInline):
@@ -52,6 +52,16 @@ class AnswerOptions(admin.ModelAdmin):
     search_fields = ('text',)
     list_select_related=True
 
+class InterviewOptions(admin.ModelAdmin):
+    """
+    A newforms-admin options class for the ``Interview`` model.
+    """
+    list_display = ('uuid', 'survey', 'user', 'session_key', 'started',
+                    'submitted')
+    list_filter = ('survey',)
+    search_fields = ('uuid', 'session_key')
+    list_select_related = True
+
 class ChoiceOptions(admin.ModelAdmin):
     list_display = ('question','text',)
     search_fields = ('text',)
@@ -78,3 +88,8 @@ try:
     admin.site.register(Choice, ChoiceOptions)
 except:
     pass
+
+try:
+    admin.site.register(Interview, InterviewOptions)
+except:
+    pass
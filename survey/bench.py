@@ -0,0 +1,387 @@
+"""Survey Benchmarks
+
+A seeded generator of synthetic surveys and the timing of the hot paths of
+the survey pages, run with the survey_bench command, and the concurrent
+respondent flows of the survey_loadtest command.
+"""
+from __future__ import with_statement
+
+import datetime
+import math
+import Queue
+import random
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+import uuid
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.urlresolvers import reverse
+from django.db import connections, transaction
+from django.http import QueryDict
+from django.template import Context, loader
+from django.test.client import Client
+
+from survey.forms import forms_for_survey, render_forms
+from survey.instrumentation import QueryRecorder
+from survey.models import Survey, Question, Choice, ChoiceTally, Answer,\
+                          Interview
+from survey.schema import get_schema
+
+
+# The question types generated, in turn. Image choices need files.
+GENERATED_QTYPES = ('T', 'A', 'S', 'R', 'C')
+
+# Scenarios timed by ``run_scenarios``, in order.
+SCENARIOS = ('forms_for_survey', 'survey_detail_get', 'survey_detail_post',
+             'answers_list', 'answers_detail', 'visible_survey_list')
+
+
+@transaction.commit_on_success
+def generate(surveys=5, questions=20, interviews=100, seed=0,
+             username='survey_bench', prefix='bench'):
+    """
+    Create ``surveys`` public surveys of ``questions`` questions of mixed
+    types, slugged ``prefix`` and their number, each answered by
+    ``interviews`` anonymous respondents, and the staff user owning them,
+    unless it exists, whose password is its username and who can view every
+    answer. The same seed generates the same answers. Return the surveys.
+    """
+    rand = random.Random(seed)
+    try:
+        user = User.objects.get(username=username)
+    except User.DoesNotExist:
+        user = User.objects.create_user(username,
+                                        '%s@example.com' % username, username)
+        user.is_superuser = True
+        user.is_staff = True
+        user.save()
+    created = []
+    for i in range(surveys):
+        survey = Survey(title='Bench survey %d' % i,
+                        slug='%s-%d' % (prefix, i),
+                        opens=datetime.datetime(2000, 1, 1),
+                        closes=datetime.datetime(2099, 1, 1),
+                        visible=True, public=True,
+                        created_by=user, editable_by=user)
+        survey.save()
+        choices = []
+        for j in range(questions):
+            question = Question(survey=survey, text='Question %d' % j,
+                                qtype=GENERATED_QTYPES[
+                                    j % len(GENERATED_QTYPES)],
+                                order=j)
+            question.save()
+            question_choices = []
+            if question.qtype in ('S', 'R', 'C'):
+                for k in range(rand.randint(3, 5)):
+                    choice = Choice(question=question, order=k,
+                                    text='Choice %d of %d' % (k, j))
+                    choice.save()
+                    question_choices.append(choice)
+            choices.append((question, question_choices))
+        answers = []
+        for k in range(interviews):
+            key = uuid.uuid4().hex
+            interview = Interview.objects.create(survey=survey, uuid=key,
+                                                 session_key=key)
+            for question, question_choices in choices:
+                if not question_choices:
+                    answers.append(Answer(question=question,
+                        session_key=key, interview_uuid=key,
+                        interview=interview,
+                        text='Answer %d' % rand.randint(0, 1000)))
+                    continue
+                if question.qtype == 'C':
+                    selected = rand.sample(question_choices,
+                        rand.randint(1, len(question_choices)))
+                else:
+                    selected = [rand.choice(question_choices)]
+                for choice in selected:
+                    answers.append(Answer(question=question,
+                        session_key=key, interview_uuid=key,
+                        interview=interview, choice=choice,
+                        text=choice.text))
+        Answer.objects.insert_many(answers)
+        ChoiceTally.objects.rebuild(survey)
+        created.append(survey)
+    return created
+
+def percentile(values, percent):
+    "Return the nearest rank percentile of a list of numbers."
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+def timed(function, repeat):
+    "Return the best wall clock time of ``repeat`` calls of ``function``."
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def measure(function, repeat):
+    """
+    Call ``function`` ``repeat`` times and return the p50, p95 and mean of
+    its wall clock time, in milliseconds, and the largest number of
+    queries it ran.
+    """
+    times = []
+    queries = []
+    for i in range(repeat):
+        with QueryRecorder() as recorder:
+            start = time.time()
+            function()
+            times.append((time.time() - start) * 1000)
+        queries.append(recorder.count)
+    return {'p50_ms': percentile(times, 50),
+            'p95_ms': percentile(times, 95),
+            'mean_ms': sum(times) / len(times),
+            'queries': max(queries)}
+
+def _post_data(survey):
+    "Return the POST data answering every question of a survey."
+    data = {}
+    for compiled in get_schema(survey):
+        name = '%d_%d-answer' % (survey.id, compiled.question.id)
+        if compiled.question.qtype == 'C':
+            data[name] = [key for key, text, url in compiled.choices[:2]]
+        elif compiled.choices:
+            data[name] = compiled.choices[0][0]
+        else:
+            data[name] = 'Benchmark answer'
+    return data
+
+def _checked(response):
+    "Fail the benchmark on the responses which are not a page or redirect."
+    if response.status_code not in (200, 302):
+        raise AssertionError('%s returned %d' % (response.request['PATH_INFO'],
+                                                 response.status_code))
+    return response
+
+class _Session(object):
+    session_key = 'survey_bench'
+
+class _Request(object):
+    session = _Session()
+    user = AnonymousUser()
+    POST = QueryDict('')
+
+def run_scenarios(survey, repeat=20, scenarios=SCENARIOS,
+                  username='survey_bench'):
+    """
+    Time the scenarios of ``scenarios`` on a generated survey through the
+    test client, with an anonymous respondent and the user created by
+    ``generate`` browsing the answers. Return the measures of each
+    scenario.
+    """
+    slug = survey.slug
+    respondent = Client()
+    browser = Client()
+    browser.login(username=username, password=username)
+    post_data = _post_data(survey)
+    key = survey.interviews.values_list('session_key', flat=True)[0]
+    def get(client, name, **kwargs):
+        return lambda: _checked(client.get(reverse(name, kwargs=kwargs)))
+    actions = {
+        'forms_for_survey': lambda: forms_for_survey(survey, _Request()),
+        'survey_detail_get': get(respondent, 'survey-detail',
+                                 survey_slug=slug),
+        'survey_detail_post': lambda: _checked(respondent.post(
+            reverse('survey-detail', kwargs={'survey_slug': slug}),
+            post_data)),
+        'answers_list': get(browser, 'survey-results', survey_slug=slug),
+        'answers_detail': get(browser, 'answers-detail', survey_slug=slug,
+                              key=key),
+        'visible_survey_list': get(respondent, 'surveys-visible'),
+    }
+    return dict((name, measure(actions[name], repeat)) for name in scenarios)
+
+def render_forms_per_question(forms):
+    """
+    Render answer forms the way ``BaseAnswerForm.as_template`` used to, with
+    a template lookup, a context and a render per question.
+    """
+    return u''.join(loader.get_template('forms/form.html').render(
+        Context({'form': form, 'bound_fields': form.bound_fields()}))
+        for form in forms)
+
+def bench_render_forms(forms, repeat=10):
+    """
+    Return the best times of rendering ``forms`` per question and in a
+    single pass with ``render_forms``, after checking both render the same
+    HTML.
+    """
+    if render_forms_per_question(forms) != render_forms(forms):
+        raise AssertionError('render_forms differs from the per question '
+                             'rendering')
+    return {'per_question': timed(lambda: render_forms_per_question(forms),
+                                  repeat),
+            'single_pass': timed(lambda: render_forms(forms), repeat)}
+
+def _path(location):
+    "Return the path and query of a redirection, relative to the server."
+    if not location:
+        return None
+    parts = urlparse.urlsplit(location)
+    return parts.query and '%s?%s' % (parts.path, parts.query) or parts.path
+
+class LocalClient(object):
+    "A respondent requesting the survey pages through the test client."
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, data=None):
+        "Return the status and the redirection of a request."
+        response = getattr(self.client, method)(path, data or {})
+        return response.status_code, _path(response.get('Location', None))
+
+class _NoRedirect(urllib2.HTTPRedirectHandler):
+    def redirect_request(self, *args):
+        return None
+
+class RemoteClient(object):
+    "A respondent requesting the survey pages of a running server."
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(),
+                                           _NoRedirect())
+
+    def request(self, method, path, data=None):
+        "Return the status and the redirection of a request."
+        body = None
+        if method == 'post':
+            body = urllib.urlencode(data or {}, True)
+        try:
+            response = self.opener.open(self.base_url + path, body)
+        except urllib2.HTTPError, response:
+            pass
+        response.read()
+        return response.code, _path(response.info().get('Location'))
+
+def _step(steps, name, client, method, path, data=None, expected=(200,)):
+    """
+    Make a request of a flow, append its name, its time and whether it
+    succeeded to ``steps``, and return its redirection.
+    """
+    start = time.time()
+    try:
+        status, location = client.request(method, path, data)
+    except Exception:
+        # The server is down, or the view failed with the test client.
+        status, location = None, None
+    steps.append((name, time.time() - start, status in expected))
+    return location
+
+def respondent_flow(client, survey, post_data, steps):
+    """
+    Get a survey, post its answers and get the page the respondent is
+    redirected to, appending the steps to ``steps``.
+    """
+    path = reverse('survey-detail', kwargs={'survey_slug': survey.slug})
+    _step(steps, 'get_survey', client, 'get', path)
+    location = _step(steps, 'post_answers', client, 'post', path, post_data,
+                     expected=(302,))
+    if location:
+        _step(steps, 'follow_redirect', client, 'get', location)
+
+def browse_flow(client, survey, steps):
+    "Get the results of a survey, appending the step to ``steps``."
+    _step(steps, 'browse_results', client, 'get',
+          reverse('survey-results', kwargs={'survey_slug': survey.slug}))
+
+def run_load(surveys, flows=200, concurrency=10, browse_every=5,
+             client_class=LocalClient, client_args=()):
+    """
+    Run ``flows`` flows spread over ``surveys`` from ``concurrency``
+    threads, each flow with a new client. One flow in ``browse_every``
+    browses the results, the others answer the survey. Return the report
+    of ``load_report``.
+    """
+    targets = [(survey, _post_data(survey)) for survey in surveys]
+    pending = Queue.Queue()
+    for i in range(flows):
+        pending.put(i)
+    steps = []
+    def worker():
+        try:
+            while True:
+                try:
+                    i = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                survey, post_data = targets[i % len(targets)]
+                client = client_class(*client_args)
+                if browse_every and i % browse_every == browse_every - 1:
+                    browse_flow(client, survey, steps)
+                else:
+                    respondent_flow(client, survey, post_data, steps)
+        finally:
+            for connection in connections.all():
+                connection.close()
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return load_report(steps, time.time() - start)
+
+def load_report(steps, elapsed):
+    """
+    Return the throughput, error rate and latency percentiles of the steps
+    of the flows run in ``elapsed`` seconds, overall and per step.
+    """
+    def summary(steps):
+        times = [seconds * 1000 for name, seconds, ok in steps]
+        errors = len([ok for name, seconds, ok in steps if not ok])
+        return {'requests': len(steps), 'errors': errors,
+                'error_rate': steps and float(errors) / len(steps) or 0.0,
+                'p50_ms': percentile(times, 50),
+                'p95_ms': percentile(times, 95),
+                'p99_ms': percentile(times, 99)}
+    report = summary(steps)
+    report['seconds'] = elapsed
+    report['throughput'] = elapsed and len(steps) / elapsed or None
+    names = set(name for name, seconds, ok in steps)
+    report['steps'] = dict((name, summary([step for step in steps
+                                           if step[0] == name]))
+                           for name in names)
+    return report
+
+def check_interviews(survey):
+    """
+    Return the uuids of the duplicate and of the partial interviews of a
+    survey. An interview is a duplicate when it repeats an answer, or when
+    its respondent already had an interview of a survey accepting a single
+    one. It is partial when a required question has no answer.
+    """
+    answers = dict((interview, []) for interview in
+                   survey.interviews.values_list('uuid', flat=True))
+    for interview, question, choice in Answer.objects.filter(
+            interview__survey=survey).values_list('interview__uuid',
+                                                  'question', 'choice'):
+        answers[interview].append((question, choice))
+    required = set(survey.questions.filter(required=True)
+                                   .values_list('id', flat=True))
+    duplicate = [interview for interview, answered in answers.items()
+                 if len(set(answered)) < len(answered)]
+    partial = [interview for interview, answered in answers.items()
+               if not required <= set(question for question, choice
+                                      in answered)]
+    if not survey.allows_multiple_interviews:
+        respondents = set()
+        for interview, key in survey.interviews.order_by('started', 'id')\
+                .values_list('uuid', 'session_key'):
+            if key in respondents and interview not in duplicate:
+                duplicate.append(interview)
+            respondents.add(key)
+    return {'duplicate': sorted(duplicate), 'partial': sorted(partial)}
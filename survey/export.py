@@ -0,0 +1,139 @@
+"""Survey Export
+
+Stream the answers of a survey with one row per interview and one column
+per question. The interviews are read in chunks with keyset pagination on
+their id, and the answers of each chunk through their interview, so that
+neither the memory used nor the cost of a chunk depends on the size of the
+survey.
+"""
+import csv
+
+from django.db.models import Q
+from django.utils import simplejson
+
+from survey.models import Answer, Interview
+
+
+# Number of answers read per query, about.
+CHUNK_SIZE = 1000
+
+# Separates the choices of a checkbox question in a CSV cell.
+MULTIPLE_SEPARATOR = u'; '
+
+_ANSWER_FIELDS = ('id', 'interview_uuid', 'question', 'session_key',
+                  'user__username', 'submission_date', 'text')
+
+
+def answer_chunks(survey, chunk_size=CHUNK_SIZE):
+    """
+    Yield the answers of a survey in lists of about ``chunk_size`` tuples,
+    ordered by interview so that an interview can be emitted as soon as the
+    next one starts.
+
+    Each chunk reads the interviews following the last one of the previous
+    chunk by id, instead of using an OFFSET, and then their answers through
+    the index of their interview, so every chunk costs the same to fetch.
+    The answers not linked to an interview yet, see the
+    backfill_interviews command, come last.
+    """
+    per_chunk = max(1, chunk_size // max(1, survey.questions.count()))
+    interviews = Interview.objects.filter(survey=survey.id).order_by('id')\
+                                  .values_list('id', flat=True)
+    last_id = 0
+    while True:
+        ids = list(interviews.filter(id__gt=last_id)[:per_chunk])
+        if not ids:
+            break
+        chunk = list(Answer.objects.filter(interview__in=ids)
+                     .order_by('interview', 'id')
+                     .values_list(*_ANSWER_FIELDS))
+        if chunk:
+            yield chunk
+        if len(ids) < per_chunk:
+            break
+        last_id = ids[-1]
+    # Resumes after the last (interview_uuid, id), as the uuids group them.
+    answers = Answer.objects.filter(question__survey=survey.id,
+                                    interview__isnull=True)\
+        .order_by('interview_uuid', 'id').values_list(*_ANSWER_FIELDS)
+    chunk = list(answers[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id, last_uuid = chunk[-1][:2]
+        chunk = list(answers.filter(Q(interview_uuid__gt=last_uuid) |
+                                    Q(interview_uuid=last_uuid,
+                                      id__gt=last_id))[:chunk_size])
+
+def interviews(survey, chunk_size=CHUNK_SIZE):
+    """
+    Yield a dictionary per interview of the survey, with the texts of its
+    answers in ``answers`` keyed by question id.
+    """
+    interview = None
+    for chunk in answer_chunks(survey, chunk_size):
+        for id, uuid, question_id, session_key, username, date, text in chunk:
+            if interview is None or interview['interview_uuid'] != uuid:
+                if interview is not None:
+                    yield interview
+                interview = {'interview_uuid': uuid,
+                             'session_key': session_key,
+                             'user': username,
+                             'submission_date': date,
+                             'answers': {}}
+            interview['submission_date'] = max(interview['submission_date'],
+                                               date)
+            interview['answers'].setdefault(question_id, []).append(text)
+    if interview is not None:
+        yield interview
+
+class _Echo(object):
+    "File-like object handing back what the csv writer writes."
+    def write(self, value):
+        return value
+
+def _encode(value):
+    if value is None:
+        return ''
+    return unicode(value).encode('utf-8')
+
+def export_csv(survey, chunk_size=CHUNK_SIZE):
+    "Yield the lines of the CSV export of the answers of a survey."
+    questions = list(survey.questions.all())
+    writer = csv.writer(_Echo())
+    yield writer.writerow([_encode(h) for h in
+                           ['interview_uuid', 'session_key', 'user',
+                            'submission_date'] + [q.text for q in questions]])
+    for interview in interviews(survey, chunk_size):
+        answers = interview['answers']
+        yield writer.writerow(
+            [_encode(interview[key]) for key in
+             ('interview_uuid', 'session_key', 'user', 'submission_date')] +
+            [_encode(MULTIPLE_SEPARATOR.join(answers.get(q.id, [])))
+             for q in questions])
+
+def export_jsonl(survey, chunk_size=CHUNK_SIZE):
+    """
+    Yield the lines of the JSON lines export of the answers of a survey.
+    The answers of checkbox questions are lists, the others are strings.
+    """
+    questions = list(survey.questions.all())
+    for interview in interviews(survey, chunk_size):
+        answers = {}
+        for question in questions:
+            texts = interview['answers'].get(question.id, [])
+            if question.qtype == 'C':
+                answers[question.text] = texts
+            else:
+                answers[question.text] = texts and texts[0] or None
+        interview['answers'] = answers
+        interview['submission_date'] = interview['submission_date']\
+                                       .isoformat()
+        yield simplejson.dumps(interview) + '\n'
+
+# Export function and mimetype of each export format.
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'jsonl': (export_jsonl, 'application/x-jsonlines'),
+}
@@ -1,5 +1,11 @@
-from models import QTYPE_CHOICES, Answer, Survey, Question, Choice
+from models import QTYPE_CHOICES, Answer, Survey, Question, Choice, ChoiceTally,\
+                   Interview, CACHE_TIMEOUT, bump_results_version,\
+                   schema_version
+from schema import CompiledQuestion, get_schema
+from respondents import get_respondent
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.forms import BaseForm, Form, ValidationError
 from django.forms import CharField, ChoiceField, SplitDateTimeField,\
                             CheckboxInput, BooleanField,FileInput,\
@@ -9,6 +15,7 @@ from django.forms import Textarea, TextInput, Select, RadioSelect,\
                             SplitDateTimeWidget,MultiWidget, MultiValueField
 from django.forms.forms import BoundField
 from django.forms.models import ModelForm
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 from django.utils.safestring import mark_safe
 from django.template import Context, loader
@@ -18,26 +25,52 @@ from itertools import chain
 import uuid
 
 
+# Compiled form templates by template name, see ``get_form_template``.
+_form_templates = {}
+
+def get_form_template(template_name):
+    """
+    Return a compiled form template, loaded once per process as the answer
+    forms of a survey are rendered with a handful of templates.
+    """
+    template = _form_templates.get(template_name)
+    if template is None:
+        template = _form_templates[template_name] = \
+            loader.get_template(template_name)
+    return template
+
 class BaseAnswerForm(Form):
+    # Existing answers removed by saving the form.
+    deleted_answers = ()
+    # The template rendering the form, which can differ per question type.
+    template_name = 'forms/form.html'
+
     def __init__(self, question, user, interview_uuid, session_key, edit_existing=False, *args, **kwdargs):
         self.question = question
+        # The CompiledQuestion of ``question``, compiled on demand if needed.
+        self.compiled = kwdargs.pop('compiled', None)
+        # The existing answers to edit, looked up on demand if needed.
+        self.answers = kwdargs.pop('answers', None)
         self.session_key = session_key.lower()
         self.user = user
         self.interview_uuid = interview_uuid
+        if self.answers is None:
+            self.answers = []
+            if edit_existing:
+                if not user.is_authenticated():
+                    query = question.answers.filter(session_key=session_key)
+                else:
+                    query = question.answers.filter(user=user)
+                self.answers = list(query)
         self.answer = None
         initial = None
-        if edit_existing:
-            if not user.is_authenticated():
-                query = question.answers.filter(session_key=session_key)
-            else:
-                query = question.answers.filter(user=user)
-            if query.count():
-                self.answer = query[0]
-                initial = self.answer.text
-                if 'initial' not in kwdargs:
-                    kwdargs['initial'] = {}
-                if 'answer' not in kwdargs['initial']:
-                    kwdargs['initial']['answer'] = self.answer.text
+        if self.answers:
+            self.answer = self.answers[0]
+            initial = self.answer.text
+            if 'initial' not in kwdargs:
+                kwdargs['initial'] = {}
+            if 'answer' not in kwdargs['initial']:
+                kwdargs['initial']['answer'] = self.answer.text
         super(BaseAnswerForm, self).__init__(*args, **kwdargs)
         answer = self.fields['answer']
         answer.required = question.required
@@ -49,16 +82,12 @@ class BaseAnswerForm(Form):
                 ## rats.. we are a choice list style and need to map to id.
                 answer.initial = initial
 
+    def bound_fields(self):
+        return [BoundField(self, field, name) for name, field in self.fields.items()]
+
     def as_template(self):
         "Helper function for fieldsting fields data from form."
-        bound_fields = [BoundField(self, field, name) for name, field in self.fields.items()]
-        c = Context(dict(form = self, bound_fields = bound_fields))
-        # TODO: check for template ... if template does not exist
-        # we could just get_template_from_string to some default
-        # or we could pass in the template name ... whatever we want
-        # import pdb; pdb.set_trace()
-        t = loader.get_template('forms/form.html')
-        return t.render(c)
+        return render_forms([self])
 
     def save(self, commit=True):
         if not self.cleaned_data['answer']:
@@ -79,6 +108,10 @@ class BaseAnswerForm(Form):
         if commit: ans.save()
         return ans
 
+    def tally_changes(self):
+        "Return the (choice id, delta) pairs saving the answer adds to the tallies."
+        return []
+
 class TextInputAnswer(BaseAnswerForm):
     answer = CharField()
 
@@ -105,25 +138,33 @@ class NullSelect(Select):
         self.choices = base_choices
         return result
 
+def _selected(answer, key, text):
+    """
+    Whether an answer selected the choice ``key``. The answers saved before
+    they referenced their choice are matched by text.
+    """
+    if answer.choice_id is not None:
+        return str(answer.choice_id) == key
+    return answer.text == text
+
 class ChoiceAnswer(BaseAnswerForm):
     answer = ChoiceField(widget=NullSelect)
 
     def __init__(self, *args, **kwdargs):
         super(ChoiceAnswer, self).__init__(*args, **kwdargs)
+        if self.compiled is None:
+            self.compiled = CompiledQuestion(self.question,
+                self.question.choices.all().order_by("order"))
         choices = []
-        choices_dict = {}
         self.initial_answer = None
-        for opt in self.question.choices.all().order_by("order"):
-            if opt.image and opt.image.url:
-                text = mark_safe(opt.text + '<br/><img src="%s"/>'%opt.image.url)
-            else:
-                text = opt.text
-            if self.answer is not None and self.answer.text == opt.text:
-                self.initial_answer = str(opt.id)
-            choices.append((str(opt.id),text))
-            choices_dict[str(opt.id)] = opt.text
+        for key, text, image_url in self.compiled.choices:
+            if self.answer is not None and _selected(self.answer, key, text):
+                self.initial_answer = key
+            if image_url:
+                text = mark_safe(text + '<br/><img src="%s"/>'%image_url)
+            choices.append((key,text))
         self.choices = choices
-        self.choices_dict = choices_dict
+        self.choices_dict = self.compiled.choices_dict
         self.fields['answer'].choices = choices
         self.fields['answer'].initial = self.initial_answer
         if self.initial_answer is not None:
@@ -132,8 +173,31 @@ class ChoiceAnswer(BaseAnswerForm):
         key = self.cleaned_data['answer']
         if not key and self.fields['answer'].required:
             raise ValidationError, _('This field is required.')
+        self.choice_ids = key in self.choices_dict and [key] or []
         return self.choices_dict.get(key, key)
 
+    def save(self, commit=True):
+        if self.cleaned_data['answer']:
+            if self.answer is None:
+                self.answer = Answer()
+            self.answer.choice_id = (self.choice_ids and
+                                     int(self.choice_ids[0]) or None)
+        ans = super(ChoiceAnswer, self).save(commit)
+        if commit and ans is not None:
+            for choice_id, delta in self.tally_changes():
+                ChoiceTally.objects.add(self.question, choice_id, delta)
+        return ans
+
+    def tally_changes(self):
+        changes = []
+        for choice_id in self.choice_ids:
+            if choice_id == self.initial_answer:
+                continue
+            if self.initial_answer is not None:
+                changes.append((self.initial_answer, -1))
+            changes.append((choice_id, 1))
+        return changes
+
 class ChoiceRadio(ChoiceAnswer):
     def __init__(self, *args, **kwdargs):
         super(ChoiceRadio, self).__init__(*args, **kwdargs)
@@ -151,23 +215,24 @@ class ChoiceCheckbox(BaseAnswerForm):
 
     def __init__(self, *args, **kwdargs):
         super(ChoiceCheckbox, self).__init__(*args, **kwdargs)
+        if self.compiled is None:
+            self.compiled = CompiledQuestion(self.question,
+                self.question.choices.all().order_by("order"))
         choices = []
-        choices_dict = {}
-        self.initial_answer = None
-        for opt in self.question.choices.all().order_by("order"):
-            text = opt.text
-            if opt.image and opt.image.url:
-                text = mark_safe(opt.text + '<br />' + opt.image.url)
-            choices.append((str(opt.id),text))
-            choices_dict[str(opt.id)] = opt.text
-            if self.answer is not None and self.answer.text == opt.text:
-                self.initial_answer = str(opt.id)
+        # A checkbox question has an answer per checked choice.
+        self.initial_answer = []
+        for key, text, image_url in self.compiled.choices:
+            if [ans for ans in self.answers if _selected(ans, key, text)]:
+                self.initial_answer.append(key)
+            if image_url:
+                text = mark_safe(text + '<br />' + image_url)
+            choices.append((key,text))
 
         self.choices = choices
-        self.choices_dict = choices_dict
+        self.choices_dict = self.compiled.choices_dict
         self.fields['answer'].choices = choices
         self.fields['answer'].initial = self.initial_answer
-        if self.initial_answer is not None:
+        if self.initial_answer:
             self.initial['answer'] = self.initial_answer
     def clean_answer(self):
 
@@ -177,22 +242,43 @@ class ChoiceCheckbox(BaseAnswerForm):
         for key in keys:
             if not key and self.fields['answer'].required:
                 raise ValidationError, _('Invalid Choice.')
+        self.choice_ids = [key for key in keys if key in self.choices_dict]
+        self.choice_keys = keys
         return [self.choices_dict.get(key, key) for key in keys]
     def save(self, commit=True):
         if not self.cleaned_data['answer']:
             if self.fields['answer'].required:
                 raise ValidationError, _('This field is required.')
             return
+        existing = dict((ans.choice_id and str(ans.choice_id) or ans.text, ans)
+                        for ans in self.answers)
         ans_list = []
-        for text in self.cleaned_data['answer']:
-            ans = Answer()
+        for key, text in zip(self.choice_keys, self.cleaned_data['answer']):
+            ans = existing.pop(key, None) or existing.pop(text, None) or Answer()
+            ans.choice_id = key in self.choices_dict and int(key) or None
             ans.question = self.question
             ans.session_key = self.session_key
+            if self.user.is_authenticated():
+                ans.user = self.user
+            ans.interview_uuid = self.interview_uuid
             ans.text = text
             if commit: ans.save()
             ans_list.append(ans)
+        # The choices which are no longer checked.
+        self.deleted_answers = existing.values()
+        if commit:
+            for ans in self.deleted_answers:
+                ans.delete()
+            for choice_id, delta in self.tally_changes():
+                ChoiceTally.objects.add(self.question, choice_id, delta)
         return ans_list
 
+    def tally_changes(self):
+        # The answers of the choices no longer checked are deleted, which
+        # takes them out of the tallies.
+        return [(choice_id, 1) for choice_id in self.choice_ids
+                if choice_id not in self.initial_answer]
+
 ## each question gets a form with one element, determined by the type
 ## for the answer.
 QTYPE_FORM = {
@@ -204,18 +290,130 @@ QTYPE_FORM = {
     'C': ChoiceCheckbox,
 }
 
+def existing_answers(survey, user, session_key):
+    """
+    Return the uuid of the last interview of a respondent, identified by
+    its user when authenticated or else by its session key, and the answers
+    of this interview grouped by question id. None and an empty dictionary
+    are returned when the respondent has not answered the survey.
+    """
+    answers = Answer.objects.filter(question__survey=survey.id)
+    if not user.is_authenticated():
+        answers = answers.filter(session_key=session_key)
+    else:
+        answers = answers.filter(user=user)
+    interview_uuid = None
+    grouped = {}
+    for ans in answers.order_by('-id'):
+        if interview_uuid is None:
+            interview_uuid = ans.interview_uuid
+        if ans.interview_uuid == interview_uuid:
+            grouped.setdefault(ans.question_id, []).insert(0, ans)
+    return interview_uuid, grouped
+
 def forms_for_survey(survey, request, edit_existing=False):
     ## add session validation to base page.
     sp = str(survey.id) + '_'
-    session_key = request.session.session_key.lower()
+    session_key = get_respondent(request).key
     login_user = request.user
     random_uuid = uuid.uuid4().hex
+    existing = {}
+    if edit_existing:
+        # The answers of the last interview are edited in place.
+        interview_uuid, existing = existing_answers(survey, login_user,
+                                                    session_key)
+        random_uuid = interview_uuid or random_uuid
     if request.POST: # bug in forms
         post = request.POST
     else:
         post = None
-    return [QTYPE_FORM[q.qtype](q, login_user, random_uuid, session_key, prefix=sp+str(q.id), data=post, edit_existing=edit_existing)
-            for q in survey.questions.all().order_by("order") ]
+    return [QTYPE_FORM[c.question.qtype](c.question, login_user, random_uuid, session_key, prefix=sp+str(c.question.id), data=post, compiled=c, answers=existing.get(c.question.id, []))
+            for c in get_schema(survey) ]
+
+def render_forms(forms):
+    """
+    Render answer forms in a single pass through one context, each with the
+    compiled template of its question type.
+    """
+    context = Context()
+    html = []
+    for form in forms:
+        context.update({'form': form, 'bound_fields': form.bound_fields()})
+        html.append(get_form_template(form.template_name).render(context))
+        context.pop()
+    return mark_safe(u''.join(html))
+
+def blank_forms_html(survey, forms):
+    """
+    Return the rendered answer forms of a survey, or None when they are
+    bound or pre-filled. The blank forms are the same for every respondent,
+    so they are rendered once per schema version and language.
+    """
+    if [form for form in forms if form.is_bound or form.initial]:
+        return None
+    key = 'survey_%d_forms_%s_%s' % (survey.id, schema_version(survey.id),
+                                     translation.get_language())
+    html = cache.get(key)
+    if html is None:
+        html = render_forms(forms)
+        cache.set(key, html, CACHE_TIMEOUT)
+    return mark_safe(html)
+
+def collect_answers(forms):
+    """
+    Return the unsaved answers of valid answer forms, and their summed
+    tally changes as a dictionary mapping (question id, choice id) to a
+    delta.
+    """
+    answers = []
+    tallies = {}
+    for form in forms:
+        saved = form.save(commit=False)
+        if saved is None:
+            continue
+        if not isinstance(saved, list):
+            saved = [saved]
+        answers.extend(saved)
+        for choice_id, delta in form.tally_changes():
+            key = (form.question.id, choice_id)
+            tallies[key] = tallies.get(key, 0) + delta
+    return answers, tallies
+
+@transaction.commit_on_success
+def _write_answers(forms, single=False):
+    answers, tallies = collect_answers(forms)
+    if answers:
+        interview = Interview.objects.record(forms[0].question.survey_id,
+                                             answers[0], single)
+        for ans in answers:
+            ans.interview = interview
+    deleted = [ans.id for form in forms for ans in form.deleted_answers]
+    if deleted:
+        Answer.objects.filter(id__in=deleted).delete()
+    for ans in answers:
+        if ans.id:
+            # An existing answer being edited.
+            ans.save()
+    Answer.objects.insert_many([ans for ans in answers if not ans.id])
+    ChoiceTally.objects.add_many(tallies)
+    return len(answers)
+
+def save_answers(forms, single=False):
+    """
+    Save the answers of valid answer forms, and the tallies they change, in
+    a single transaction with multi-row inserts.
+
+    With ``single``, for the surveys accepting a single interview, nothing
+    is saved and ``InterviewClaimed`` is raised if the respondent already
+    answered. Return the number of answers written.
+    """
+    written = _write_answers(forms, single)
+    # The answer signals are not sent by the multi-row inserts, and results
+    # computed while the answers were being committed could have been
+    # cached under the current version anyway.
+    for survey_id in set(form.question.survey_id for form in forms):
+        bump_results_version(survey_id)
+    return written
 
 class CustomDateWidget(TextInput):
     class Media:
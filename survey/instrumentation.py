@@ -0,0 +1,246 @@
+"""Query and Timing Instrumentation
+
+Record the queries run while serving a request or running a block of code:
+their number, their total time and the statements run more than once with
+different parameters, the usual sign of a query per row.
+
+    with QueryRecorder() as recorder:
+        ...
+    recorder.count, recorder.time, recorder.duplicates
+
+``QueryCountMiddleware`` records every request and logs a line per view on
+the ``survey.queries`` logger.
+
+The views decorated with ``timed_view`` split their time between the
+database and the phases they mark with ``phase``, send it with the
+``view_timed`` signal and log it on the ``survey.timings`` logger. When the
+SURVEY_PROFILE_DIR setting names a directory, one request in
+SURVEY_PROFILE_EVERY of those views is run under cProfile and its stats
+are written to that directory, in a file named after the view and the
+survey slug.
+"""
+from __future__ import with_statement
+
+import cProfile
+from contextlib import contextmanager
+import itertools
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.dispatch import Signal
+from django.utils.functional import wraps
+
+
+PROFILE_DIR = getattr(settings, 'SURVEY_PROFILE_DIR', None)
+
+PROFILE_EVERY = getattr(settings, 'SURVEY_PROFILE_EVERY', 100)
+
+logger = logging.getLogger('survey.queries')
+
+timings_logger = logging.getLogger('survey.timings')
+
+# Sent by the views decorated with ``timed_view``, with the milliseconds
+# spent in each phase.
+view_timed = Signal(providing_args=['request', 'survey_slug', 'timings'])
+
+_requests = itertools.count(1)
+
+
+class _RecordingCursor(object):
+    "Cursor wrapper adding its statements to a ``QueryRecorder``."
+    def __init__(self, cursor, recorder):
+        self.cursor = cursor
+        self.recorder = recorder
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.recorder.queries.append((sql, time.time() - start))
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.recorder.queries.append((sql, time.time() - start))
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+class QueryRecorder(object):
+    """
+    Record the statements run on a database connection, or on all of them
+    when ``using`` is None, by the current thread, whatever the DEBUG
+    setting, as (sql, seconds) pairs in ``queries``. The sql is the
+    statement before its parameters are substituted, so it fingerprints
+    the query. Recorders can be nested.
+    """
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.queries = []
+
+    def _aliases(self):
+        if self.using is None:
+            return list(connections)
+        return [self.using]
+
+    def _recording(self, cursor):
+        def recording_cursor():
+            return _RecordingCursor(cursor(), self)
+        return recording_cursor
+
+    def start(self):
+        # The connections are thread local, so is the patched cursor.
+        self._previous = {}
+        for alias in self._aliases():
+            connection = connections[alias]
+            self._previous[alias] = connection.__dict__.get('cursor')
+            connection.cursor = self._recording(connection.cursor)
+        return self
+
+    def stop(self):
+        for alias, previous in self._previous.items():
+            connection = connections[alias]
+            if previous is None:
+                del connection.cursor
+            else:
+                connection.cursor = previous
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        "Total time of the recorded statements, in seconds."
+        return sum(elapsed for sql, elapsed in self.queries)
+
+    @property
+    def duplicates(self):
+        """
+        Return the statements run more than once and how many times, most
+        repeated first.
+        """
+        counts = {}
+        for sql, elapsed in self.queries:
+            counts[sql] = counts.get(sql, 0) + 1
+        return sorted([(count, sql) for sql, count in counts.items()
+                       if count > 1], reverse=True)
+
+class QueryCountMiddleware(object):
+    """
+    Record the queries of each request in ``request.survey_queries`` and log
+    their number, time and duplicates per view.
+    """
+    def process_request(self, request):
+        request.survey_queries = QueryRecorder().start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.survey_view = '%s.%s' % (view_func.__module__,
+                                         view_func.__name__)
+
+    def process_response(self, request, response):
+        recorder = getattr(request, 'survey_queries', None)
+        if recorder is not None:
+            recorder.stop()
+            del request.survey_queries
+            logger.info('%s %s queries=%d time=%.3f duplicates=%d',
+                        getattr(request, 'survey_view', '-'), request.path,
+                        recorder.count, recorder.time,
+                        sum(count for count, sql in recorder.duplicates))
+        return response
+
+class Timings(object):
+    """
+    The seconds a view spends in the phases it marks. The queries are
+    timed apart: a phase only counts its time outside of the database.
+    """
+    def __init__(self):
+        self.recorder = QueryRecorder(using=None)
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start, sql = time.time(), self.recorder.time
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start - (self.recorder.time - sql)
+            self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def breakdown(self, total):
+        """
+        Return the milliseconds of ``total`` seconds spent in the database,
+        in each phase and elsewhere.
+        """
+        sql = self.recorder.time
+        breakdown = {'total_ms': total * 1000, 'sql_ms': sql * 1000,
+                     'other_ms': (total - sql - sum(self.phases.values()))
+                                 * 1000}
+        for name, elapsed in self.phases.items():
+            breakdown['%s_ms' % name] = elapsed * 1000
+        return breakdown
+
+@contextmanager
+def _untimed():
+    yield
+
+def phase(request, name):
+    "Time a phase of a view decorated with ``timed_view``."
+    timings = getattr(request, 'survey_timings', None)
+    if timings is None:
+        return _untimed()
+    return timings.phase(name)
+
+def _profiled(view, slug, request, *args, **kwargs):
+    "Run a view under cProfile and write its stats to PROFILE_DIR."
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(view, request, *args, **kwargs)
+    finally:
+        if not os.path.isdir(PROFILE_DIR):
+            os.makedirs(PROFILE_DIR)
+        profile.dump_stats(os.path.join(PROFILE_DIR, '%s.%s.%d.%d.prof' % (
+            view.__name__, slug or '-', time.time() * 1000, os.getpid())))
+
+def timed_view(view):
+    """
+    Decorator timing the phases of a view, see ``phase``, and profiling one
+    request in PROFILE_EVERY when PROFILE_DIR is set.
+    """
+    def wrapper(request, *args, **kwargs):
+        slug = kwargs.get('survey_slug')
+        timings = request.survey_timings = Timings()
+        start = time.time()
+        timings.recorder.start()
+        try:
+            if PROFILE_DIR and _requests.next() % PROFILE_EVERY == 0:
+                response = _profiled(view, slug, request, *args, **kwargs)
+            else:
+                response = view(request, *args, **kwargs)
+        finally:
+            timings.recorder.stop()
+            del request.survey_timings
+        breakdown = timings.breakdown(time.time() - start)
+        view_timed.send(sender=view, request=request, survey_slug=slug,
+                        timings=breakdown)
+        timings_logger.info('view=%s survey=%s queries=%d %s', view.__name__,
+                            slug or '-', timings.recorder.count,
+                            ' '.join('%s=%.1f' % item
+                                     for item in sorted(breakdown.items())))
+        return response
+    return wraps(view)(wrapper)
@@ -0,0 +1,14 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from survey.models import Interview
+
+
+class Command(NoArgsCommand):
+    help = ('Create the interviews of the answers saved before the '
+            'interviews were recorded.')
+
+    def handle_noargs(self, **options):
+        created = transaction.commit_on_success(Interview.objects.backfill)()
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Created %d interviews' % created
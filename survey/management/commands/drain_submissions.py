@@ -0,0 +1,43 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from survey import spool
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=spool.DRAIN_BATCH_SIZE,
+                    help='Number of submissions inserted per transaction.'),
+        make_option('--loop', dest='loop', action='store_true', default=False,
+                    help='Keep draining the spool until interrupted.'),
+        make_option('--interval', dest='interval', type='float', default=1.0,
+                    help='Seconds to wait when the spool is empty in --loop '
+                         'mode.'),
+        make_option('--stats', dest='stats', action='store_true',
+                    default=False,
+                    help='Only print the number of pending submissions and '
+                         'the lag of the oldest one.'),
+    )
+    help = ('Insert the submissions spooled by survey_detail when '
+            'SURVEY_SUBMISSION_SPOOL is set.')
+
+    def handle_noargs(self, **options):
+        if not spool.enabled():
+            raise CommandError('SURVEY_SUBMISSION_SPOOL is not set.')
+        verbosity = int(options.get('verbosity', 1))
+        if options['stats']:
+            print 'pending %(pending)d lag %(lag).3f' % spool.stats()
+            return
+        while True:
+            drained = spool.drain(options['batch_size'])
+            if drained and verbosity > 0:
+                stats = spool.stats()
+                print 'drained %d pending %d lag %.3f' % (
+                    drained, stats['pending'], stats['lag'])
+            if not drained:
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
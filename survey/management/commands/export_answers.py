@@ -0,0 +1,32 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import LabelCommand, CommandError
+
+from survey.export import CHUNK_SIZE, EXPORT_FORMATS
+from survey.models import Survey
+
+
+class Command(LabelCommand):
+    option_list = LabelCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+                    choices=EXPORT_FORMATS.keys(),
+                    help='Export format: %s. Defaults to csv.' %
+                         ', '.join(EXPORT_FORMATS.keys())),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=CHUNK_SIZE,
+                    help='Number of answers read per query.'),
+    )
+    args = '<survey_slug survey_slug ...>'
+    label = 'survey slug'
+    help = ('Write the answers of the given surveys to the standard output, '
+            'one row per interview.')
+
+    def handle_label(self, survey_slug, **options):
+        try:
+            survey = Survey.objects.get(slug=survey_slug)
+        except Survey.DoesNotExist:
+            raise CommandError('Unknown survey: %s' % survey_slug)
+        export = EXPORT_FORMATS[options['format']][0]
+        for line in export(survey, options['chunk_size']):
+            sys.stdout.write(line)
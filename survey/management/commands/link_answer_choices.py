@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from survey.models import Survey, Answer, ChoiceTally
+
+
+class Command(BaseCommand):
+    args = '[survey_slug survey_slug ...]'
+    help = ('Make the answers to the choice questions of the given surveys, '
+            'or of every survey when none is given, reference their choice '
+            'and recompute the tallies.')
+
+    def handle(self, *survey_slugs, **options):
+        surveys = Survey.objects.all()
+        if survey_slugs:
+            surveys = surveys.filter(slug__in=survey_slugs)
+            missing = set(survey_slugs) - set(s.slug for s in surveys)
+            if missing:
+                raise CommandError('Unknown survey: %s' % ', '.join(missing))
+        for survey in surveys:
+            linked = transaction.commit_on_success(self.convert)(survey)
+            if int(options.get('verbosity', 1)) > 0:
+                print 'Linked %d answers of %s' % (linked, survey.slug)
+
+    def convert(self, survey):
+        linked = Answer.objects.link_choices(survey)
+        ChoiceTally.objects.rebuild(survey)
+        return linked
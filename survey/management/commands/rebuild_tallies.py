@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from survey.models import Survey, Answer, ChoiceTally
+
+
+class Command(BaseCommand):
+    args = '[survey_slug survey_slug ...]'
+    help = ('Recompute the choice tallies from the answers of the given '
+            'surveys, or of every survey when none is given.')
+
+    def handle(self, *survey_slugs, **options):
+        surveys = Survey.objects.all()
+        if survey_slugs:
+            surveys = surveys.filter(slug__in=survey_slugs)
+            missing = set(survey_slugs) - set(s.slug for s in surveys)
+            if missing:
+                raise CommandError('Unknown survey: %s' % ', '.join(missing))
+        for survey in surveys:
+            if Answer.objects.unlinked(survey).exists():
+                raise CommandError('Some answers of %s do not reference '
+                                   'their choice yet and would not be '
+                                   'counted, run link_answer_choices '
+                                   'instead.' % survey.slug)
+            transaction.commit_on_success(ChoiceTally.objects.rebuild)(survey)
+            if int(options.get('verbosity', 1)) > 0:
+                print 'Rebuilt the tallies of %s' % survey.slug
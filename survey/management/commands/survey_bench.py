@@ -0,0 +1,77 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.utils import simplejson
+
+from survey.bench import SCENARIOS, bench_render_forms, generate,\
+                         run_scenarios, _Request
+from survey.forms import forms_for_survey
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--surveys', dest='surveys', type='int', default=3,
+                    help='Number of surveys generated.'),
+        make_option('--questions', dest='questions', type='int', default=20,
+                    help='Number of questions per survey.'),
+        make_option('--interviews', dest='interviews', type='int',
+                    default=100,
+                    help='Number of interviews per survey.'),
+        make_option('--seed', dest='seed', type='int', default=0,
+                    help='Seed of the generated answers.'),
+        make_option('--repeat', dest='repeat', type='int', default=20,
+                    help='Number of runs of each scenario per survey.'),
+        make_option('--scenario', dest='scenarios', action='append',
+                    choices=SCENARIOS + ('render_forms',),
+                    help='Scenario to run, can be repeated. Defaults to '
+                         'all of them.'),
+        make_option('--output', dest='output',
+                    help='File the JSON results are written to. Defaults '
+                         'to the standard output.'),
+    )
+    help = ('Time the survey pages on generated surveys, in a test database '
+            'created and destroyed by the command, and print the p50 and '
+            'p95 latencies and the number of queries of each scenario as '
+            'JSON.')
+
+    def handle_noargs(self, **options):
+        scenarios = options['scenarios'] or SCENARIOS + ('render_forms',)
+        verbosity = int(options.get('verbosity', 1))
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            surveys = generate(options['surveys'], options['questions'],
+                               options['interviews'], options['seed'])
+            results = {}
+            for survey in surveys:
+                if verbosity > 1:
+                    print >> sys.stderr, 'Running %s' % survey.slug
+                result = run_scenarios(survey, options['repeat'],
+                    [name for name in scenarios if name in SCENARIOS])
+                if 'render_forms' in scenarios:
+                    times = bench_render_forms(
+                        forms_for_survey(survey, _Request()),
+                        options['repeat'])
+                    result['render_forms'] = dict(
+                        (name, elapsed * 1000)
+                        for name, elapsed in times.items())
+                results[survey.slug] = result
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        report = simplejson.dumps({
+            'config': dict((name, options[name]) for name in
+                           ('surveys', 'questions', 'interviews', 'seed',
+                            'repeat')),
+            'database': connection.settings_dict['ENGINE'],
+            'results': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            output = open(options['output'], 'w')
+            try:
+                output.write(report + '\n')
+            finally:
+                output.close()
+        else:
+            print report
@@ -0,0 +1,113 @@
+import tempfile
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connection
+from django.utils import simplejson
+
+from survey.bench import LocalClient, RemoteClient, check_interviews,\
+                         generate, run_load
+from survey.models import Survey
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--url', dest='url',
+                    help='Root URL of a running server, such as '
+                         'http://127.0.0.1:8000. Defaults to the test client '
+                         'on surveys generated in a test database.'),
+        make_option('--survey', dest='slugs', action='append',
+                    help='Slug of a survey of the running server to load, '
+                         'can be repeated.'),
+        make_option('--surveys', dest='surveys', type='int', default=2,
+                    help='Number of surveys generated.'),
+        make_option('--questions', dest='questions', type='int', default=10,
+                    help='Number of questions per generated survey.'),
+        make_option('--interviews', dest='interviews', type='int',
+                    default=10,
+                    help='Number of interviews per generated survey.'),
+        make_option('--seed', dest='seed', type='int', default=0,
+                    help='Seed of the generated answers.'),
+        make_option('--single-interview', dest='single',
+                    action='store_true', default=False,
+                    help='Make the generated surveys accept a single '
+                         'interview per respondent.'),
+        make_option('--flows', dest='flows', type='int', default=200,
+                    help='Number of respondent and browsing flows.'),
+        make_option('--concurrency', dest='concurrency', type='int',
+                    default=10,
+                    help='Number of threads running the flows.'),
+        make_option('--browse-every', dest='browse_every', type='int',
+                    default=5,
+                    help='One flow in this many browses the results, the '
+                         'others answer the survey.'),
+        make_option('--output', dest='output',
+                    help='File the JSON report is written to. Defaults '
+                         'to the standard output.'),
+    )
+    help = ('Answer surveys and browse their results from concurrent '
+            'threads, print the throughput, error rate and latency '
+            'percentiles as JSON, and fail on the duplicate or partial '
+            'interviews found in the database afterwards.')
+
+    def handle_noargs(self, **options):
+        if options['url'] and not options['slugs']:
+            raise CommandError('--url needs the --survey to load.')
+        old_name = None
+        if not options['url']:
+            # The threads would each see their own in-memory database.
+            settings_dict = connection.settings_dict
+            if (settings_dict['ENGINE'].endswith('sqlite3') and
+                not settings_dict['TEST_NAME']):
+                settings_dict['TEST_NAME'] = tempfile.mktemp(suffix='.db')
+            old_name = connection.creation.create_test_db(verbosity=0,
+                                                          autoclobber=True)
+        try:
+            if options['url']:
+                surveys = []
+                for slug in options['slugs']:
+                    try:
+                        surveys.append(Survey.objects.get(slug=slug))
+                    except Survey.DoesNotExist:
+                        raise CommandError('No survey %s in the database.' %
+                                           slug)
+                client_class, client_args = RemoteClient, (options['url'],)
+            else:
+                surveys = generate(options['surveys'], options['questions'],
+                                   options['interviews'], options['seed'])
+                for survey in surveys:
+                    survey.allows_multiple_interviews = not options['single']
+                    survey.save()
+                client_class, client_args = LocalClient, ()
+            results = run_load(surveys, options['flows'],
+                               options['concurrency'],
+                               options['browse_every'],
+                               client_class, client_args)
+            interviews = dict((survey.slug, check_interviews(survey))
+                              for survey in surveys)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        report = simplejson.dumps({
+            'config': dict((name, options[name]) for name in
+                           ('url', 'surveys', 'questions', 'interviews',
+                            'seed', 'single', 'flows', 'concurrency',
+                            'browse_every')),
+            'database': connection.settings_dict['ENGINE'],
+            'results': results,
+            'interviews': interviews,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            output = open(options['output'], 'w')
+            try:
+                output.write(report + '\n')
+            finally:
+                output.close()
+        else:
+            print report
+        duplicate = sum(len(found['duplicate'])
+                        for found in interviews.values())
+        partial = sum(len(found['partial']) for found in interviews.values())
+        if duplicate or partial:
+            raise CommandError('%d duplicate and %d partial interviews.' %
+                               (duplicate, partial))
@@ -0,0 +1,81 @@
+"""
+Upgrade the survey tables of an install created before the answers
+referenced their interview and their choice. syncdb creates the new tables
+but neither adds columns to an existing table nor runs sql/answer.sql on it.
+Upgrade in this order:
+
+    manage.py syncdb
+    manage.py upgrade_survey_schema
+    manage.py backfill_interviews
+    manage.py link_answer_choices
+"""
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import connection, transaction
+
+from survey.models import Answer
+
+
+# The columns of the answers added since the first release.
+NEW_COLUMNS = ('interview', 'choice')
+
+
+def upgrade_statements():
+    """
+    Return the statements adding the missing columns of the answers, with
+    their indexes and the ones of sql/answer.sql, none once upgraded.
+    """
+    qn = connection.ops.quote_name
+    opts = Answer._meta
+    cursor = connection.cursor()
+    columns = set(row[0] for row in connection.introspection
+                  .get_table_description(cursor, opts.db_table))
+    fields = [opts.get_field(name) for name in NEW_COLUMNS
+              if opts.get_field(name).column not in columns]
+    statements = []
+    for field in fields:
+        to = field.rel.to._meta
+        statements.append('ALTER TABLE %s ADD COLUMN %s %s NULL '
+                          'REFERENCES %s (%s)%s;' % (
+            qn(opts.db_table), qn(field.column),
+            field.db_type(connection=connection), qn(to.db_table),
+            qn(to.get_field(field.rel.field_name).column),
+            connection.ops.deferrable_sql()))
+    for field in fields:
+        statements.extend(connection.creation.sql_indexes_for_field(
+            Answer, field, no_style()))
+    if fields:
+        statements.extend(statement.strip() for statement in
+                          custom_sql_for_model(Answer, no_style(), connection))
+    return statements
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--sql', dest='sql', action='store_true', default=False,
+                    help='Print the statements instead of running them.'),
+    )
+    help = ('Add the interview and choice columns, and their indexes, to '
+            'the answers table of an existing install, after syncdb and '
+            'before backfill_interviews and link_answer_choices.')
+
+    def handle_noargs(self, **options):
+        statements = upgrade_statements()
+        if options['sql']:
+            for statement in statements:
+                print statement
+            return
+        transaction.commit_on_success(self.execute_all)(statements)
+        if int(options.get('verbosity', 1)) > 0:
+            if statements:
+                print ('Upgraded the answers table, now run '
+                       'backfill_interviews then link_answer_choices')
+            else:
+                print 'The answers table is up to date'
+
+    def execute_all(self, statements):
+        cursor = connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
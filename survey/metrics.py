@@ -0,0 +1,189 @@
+"""Survey Metrics
+
+Counters and latency histograms kept in the memory of each process, and
+exposed by the ``metrics`` view in the Prometheus text exposition format,
+so that the scrapes of the processes behind a load balancer add up.
+
+    submissions.inc(survey='my-survey', outcome='saved')
+    REGISTRY.exposition()
+"""
+import threading
+
+from survey.instrumentation import view_timed
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds, in seconds, of the buckets of the latency histograms.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"')\
+                         .replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in labels)
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+class Metric(object):
+    "A metric and its values per set of labels, safe to use from threads."
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        if sorted(labels) != sorted(self.labels):
+            raise ValueError('%s takes the labels %s' % (
+                self.name, ', '.join(self.labels)))
+        return tuple((name, labels[name]) for name in sorted(self.labels))
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.values = {}
+        finally:
+            self.lock.release()
+
+    def samples(self):
+        "Return the (name, labels, value) samples of the metric."
+        raise NotImplementedError
+
+    def exposition(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        for name, labels, value in self.samples():
+            lines.append('%s%s %s' % (name, _format_labels(labels),
+                                      _format_value(value)))
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.lock.acquire()
+        try:
+            self.values[key] = self.values.get(key, 0) + amount
+        finally:
+            self.lock.release()
+
+    def value(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        self.lock.acquire()
+        try:
+            return [(self.name, key, value)
+                    for key, value in sorted(self.values.items())]
+        finally:
+            self.lock.release()
+
+class Histogram(Metric):
+    "Observations counted in fixed buckets, with their count and sum."
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        self.lock.acquire()
+        try:
+            counts, total = self.values.get(key,
+                                            ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+        finally:
+            self.lock.release()
+
+    def count(self, **labels):
+        return sum(self.values.get(self._key(labels), ([0], 0.0))[0])
+
+    def samples(self):
+        self.lock.acquire()
+        try:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self.values.items())
+        finally:
+            self.lock.release()
+        samples = []
+        for key, (counts, total) in values:
+            cumulated = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulated += count
+                samples.append(('%s_bucket' % self.name,
+                                key + (('le', _format_value(bound)),),
+                                cumulated))
+            samples.append(('%s_sum' % self.name, key, total))
+            samples.append(('%s_count' % self.name, key, cumulated))
+        return samples
+
+class Registry(object):
+    "The metrics exposed together."
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def exposition(self):
+        "Return the metrics in the Prometheus text exposition format."
+        return ''.join('%s\n' % metric.exposition()
+                       for metric in self.metrics)
+
+REGISTRY = Registry()
+
+submissions = REGISTRY.counter('survey_submissions_total',
+    'Valid submissions of answers, by survey and outcome: saved, spooled '
+    'or refused when the respondent already answered.',
+    ('survey', 'outcome'))
+
+answers_written = REGISTRY.counter('survey_answers_written_total',
+    'Answers written to the database.', ('survey',))
+
+validation_failures = REGISTRY.counter('survey_validation_failures_total',
+    'Submissions refused because an answer form was invalid.', ('survey',))
+
+results_cache = REGISTRY.counter('survey_results_cache_total',
+    'Lookups of the cached survey results, by result: hit or miss.',
+    ('result',))
+
+view_seconds = REGISTRY.histogram('survey_view_seconds',
+    'Time spent in the timed survey views.', ('view',))
+
+
+def _observe_view(sender, timings, **kwargs):
+    view_seconds.observe(timings['total_ms'] / 1000.0, view=sender.__name__)
+
+view_timed.connect(_observe_view)
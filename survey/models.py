@@ -1,8 +1,13 @@
 """Survey Models
 """
 import datetime
+import time
+from uuid import uuid4
 
-from django.db import models
+from django.db import connections, models, router, transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.query import QuerySet
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import encoding
@@ -12,6 +17,10 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 
+from survey import metrics
+from survey.respondents import get_respondent
+from survey import routers
+
 
 
 QTYPE_CHOICES = (
@@ -23,8 +32,180 @@ QTYPE_CHOICES = (
     ('C', 'Checkbox List')
 )
 
+# Question types whose answers are one of the question choices.
+CHOICE_QTYPES = ('S', 'R', 'I', 'C')
+
+# Number of free text answers shown per page of the results.
+ANSWER_PAGE_SIZE = 20
+
+# Minimum number of seconds between two computations of the results of a
+# survey. The cached results of surveys answered faster than that are served
+# a bit stale instead of being recomputed after every submission.
+RESULTS_MIN_REFRESH = getattr(settings, 'SURVEY_RESULTS_MIN_REFRESH', 0)
+
+# Number of seconds the answers and interviews wait before being counted by
+# ``Survey.results_since``, longer than the transactions inserting them.
+RESULTS_SETTLE_SECONDS = getattr(settings, 'SURVEY_RESULTS_SETTLE_SECONDS', 5)
+
+# The versioned cache entries are replaced rather than expired.
+CACHE_TIMEOUT = 60*60*24*31
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), CACHE_TIMEOUT)
+
+def results_version(survey_id):
+    """
+    Return the version of the results of a survey, which changes each time
+    one of its answers, questions or choices is saved or deleted.
+    """
+    return _get_version('survey_%d_results_version' % survey_id)
+
+def bump_results_version(survey_id):
+    _bump_version('survey_%d_results_version' % survey_id)
+    cache.set('survey_%d_results_bumped' % survey_id, time.time(),
+              CACHE_TIMEOUT)
+
+def results_bumped(survey_id):
+    "Return when the results version of a survey last changed, or 0."
+    return cache.get('survey_%d_results_bumped' % survey_id) or 0
+
+def answers_epoch(survey_id):
+    """
+    Return the epoch of the answers of a survey, which changes each time
+    answers or interviews are changed or deleted rather than added.
+    """
+    return _get_version('survey_%d_answers_epoch' % survey_id)
+
+def bump_answers_epoch(survey_id):
+    _bump_version('survey_%d_answers_epoch' % survey_id)
+
+def schema_version(survey_id):
+    """
+    Return the version of the schema of a survey, which changes each time
+    one of its questions or choices is saved or deleted.
+    """
+    return _get_version('survey_%d_schema_version' % survey_id)
+
+def bump_schema_version(survey_id):
+    _bump_version('survey_%d_schema_version' % survey_id)
+
+def _settled_upto(rows, date_field, settled):
+    """
+    Return the id up to which ``rows`` were all added by ``settled``,
+    according to their ``date_field``: the id before the first row added
+    since, or else the last id of their table.
+    """
+    first = rows.filter(**{'%s__gt' % date_field: settled})\
+                .aggregate(Min('id'))['id__min']
+    if first is not None:
+        return first - 1
+    return rows.model.objects.aggregate(Max('id'))['id__max'] or 0
+
+def _open_state(survey, now):
+    """
+    Return whether a survey is open at ``now`` according to its dates, and
+    the number of seconds until it opens or closes, None once closed.
+    """
+    if now <= survey.opens:
+        value, change = False, survey.opens
+    elif now <= survey.closes:
+        value, change = True, survey.closes
+    else:
+        return False, None
+    delta = change - now
+    # Rounded up, the state expires once the change happened.
+    return value, (delta.days * 60*60*24 + delta.seconds +
+                   (delta.microseconds and 1))
+
+def open_states(surveys):
+    """
+    Return whether each survey is open, reading the states cached until the
+    next opening or closing of the surveys in a single cache round trip.
+    """
+    cached = cache.get_many([survey._cache_name for survey in surveys
+                             if survey.visible])
+    now = datetime.datetime.now()
+    states = []
+    for survey in surveys:
+        value = survey.visible and cached.get(survey._cache_name)
+        if survey.visible and value is None:
+            value, duration = _open_state(survey, now)
+            if duration is None:
+                duration = CACHE_TIMEOUT
+            # A zero timeout would be the default timeout of the cache.
+            if duration > 0:
+                cache.set(survey._cache_name, value, duration)
+        states.append(value)
+    return states
+
+class SurveyQuerySet(QuerySet):
+    """
+    Once ``with_stats`` has been called, the surveys fetched by this
+    QuerySet get the statistics shown by the survey lists computed for all
+    of them at once.
+    """
+    stats_request = None
+
+    def with_stats(self, request):
+        """
+        Prime the open state, the interview count and whether the
+        respondent of ``request`` has answered of every fetched survey,
+        with two queries whatever the number of surveys.
+        """
+        clone = self._clone()
+        clone.stats_request = request
+        return clone
+
+    def _clone(self, *args, **kwargs):
+        clone = super(SurveyQuerySet, self)._clone(*args, **kwargs)
+        clone.stats_request = self.stats_request
+        return clone
+
+    def iterator(self):
+        if self.stats_request is None:
+            return super(SurveyQuerySet, self).iterator()
+        surveys = list(super(SurveyQuerySet, self).iterator())
+        self._add_stats(surveys)
+        return iter(surveys)
+
+    def _add_stats(self, surveys):
+        ids = [survey.id for survey in surveys]
+        if not ids:
+            return
+        interviews = Interview.objects.filter(survey__in=ids)
+        counts = dict(interviews.values_list('survey').annotate(Count('id'))
+                      .order_by())
+        session_key = None
+        respondent = get_respondent(self.stats_request)
+        # The surveys answered are in the cookie of the respondent if kept.
+        if respondent.answered is None and respondent.key:
+            session_key = respondent.key
+            answered = set(interviews.filter(session_key=session_key)
+                           .values_list('survey', flat=True).distinct())
+        for survey, value in zip(surveys, open_states(surveys)):
+            survey._open = value
+            survey._interview_count = counts.get(survey.id, 0)
+            if session_key is not None:
+                survey._answered = {session_key: survey.id in answered}
+
 class SurveyManager(models.Manager):
 
+    def get_query_set(self):
+        return SurveyQuerySet(self.model, using=self._db)
+
+    def with_stats(self, request):
+        return self.get_query_set().with_stats(request)
+
     def surveys_for(self, recipient):
         recipient_type = ContentType.objects.get_for_model(recipient)
         return Survey.objects.filter(visible=True,recipient_type=recipient_type, recipient_id=recipient.id)
@@ -75,21 +256,8 @@ class Survey(models.Model):
     @property
     def open(self):
         if not self.visible: return False
-        value = cache.get(self._cache_name)
-        if value is not None: return value
-        now = datetime.datetime.now()
-        if self.opens >= now:
-            value = False
-            duration = (now - self.opens).seconds
-        elif self.closes >= now:
-            value = True
-            duration = (self.opens - now).seconds
-        else:
-            value = False
-            duration = 60*60*24*31
-        if duration:
-            cache.set(self._cache_name, value, duration)
-        return value
+        if hasattr(self, '_open'): return self._open
+        return open_states([self])[0]
 
     @property
     def closed(self):
@@ -99,7 +267,7 @@ class Survey(models.Model):
     def status(self):
         if not self.visible: return _('private')
         if self.open: return _('open')
-        if datetime.now() < self.opens:
+        if datetime.datetime.now() < self.opens:
             return unicode(_('opens ')) + datefilter(self.opens)
         return _('closed')
 
@@ -115,24 +283,229 @@ class Survey(models.Model):
         # NOTSURE: Do we realy need this optimisation?
         if hasattr(self, '_interview_count'):
             return self._interview_count
-        self._interview_count = len(Answer.objects.filter(
-            question__survey=self.id).values('interview_uuid').distinct())
+        self._interview_count = self.interviews.count()
         return self._interview_count
 
     @property
     def session_key_count(self):
         # NOTSURE: Do we realy need this optimisation?
         if hasattr(self, '_session_key_count'):
-            return self._submission_count
-        self._submission_count = len(Answer.objects.filter(
-            question__survey=self.id).values('session_key').distinct())
-        return self._submission_count
+            return self._session_key_count
+        self._session_key_count = self.interviews.values('session_key')\
+                                      .distinct().count()
+        return self._session_key_count
 
 
     def has_answers_from(self, session_key):
-        return bool(
-            Answer.objects.filter(session_key__exact=session_key.lower(),
-            question__survey__id__exact=self.id).distinct().count())
+        session_key = session_key.lower()
+        if not hasattr(self, '_answered'):
+            self._answered = {}
+        if session_key not in self._answered:
+            self._answered[session_key] = self.interviews.filter(
+                session_key=session_key).exists()
+        return self._answered[session_key]
+
+    def results(self):
+        """
+        Return the questions of the survey with every result needed by the
+        results page already computed.
+
+        Each question gets a ``choice_list`` and the first page of its free
+        text answers (see ``Question.answer_page``), and the
+        ``answer_count``, ``Choice.count`` and ``interview_count`` caches are
+        primed. The page costs a constant number of grouped queries and one
+        bounded query for the first pages of every free text question,
+        whatever the number of questions and answers.
+        """
+        questions = list(self.questions.all())
+        answers = Answer.objects.filter(question__survey=self.id)
+
+        answer_counts = dict(answers.exclude(question__qtype__in=CHOICE_QTYPES)
+                             .values_list('question')
+                             .annotate(Count('id')).order_by())
+        tallies = dict(ChoiceTally.objects.filter(question__survey=self.id)
+                       .values_list('choice', 'count'))
+
+        choices = {}
+        for choice in Choice.objects.filter(question__survey=self.id):
+            choice._count = tallies.get(choice.id, 0)
+            choices.setdefault(choice.question_id, []).append(choice)
+            answer_counts[choice.question_id] = (
+                answer_counts.get(choice.question_id, 0) + choice._count)
+
+        for question in questions:
+            question.survey = self
+            question._answer_count = answer_counts.get(question.id, 0)
+            question.choice_list = choices.get(question.id, [])
+            question.answer_list, question.next_cursor = [], None
+        # Only the first page of the free text answers is loaded.
+        text_questions = [question for question in questions
+                          if not question.choice_list and
+                             question._answer_count]
+        pages = Answer.objects.first_pages(
+            [question.id for question in text_questions],
+            ANSWER_PAGE_SIZE + 1)
+        for question in text_questions:
+            question._set_page(pages.get(question.id, []), 0,
+                               ANSWER_PAGE_SIZE)
+        self._answer_count = sum(answer_counts.values())
+        self._interview_count = self.interviews.count()
+        self._session_key_count = self.interviews.values('session_key')\
+                                      .distinct().count()
+        return questions
+
+    def results_since(self, cursor=None):
+        """
+        Return the answer counts per question and per choice and the
+        interview count of the survey, ready to be serialized to JSON, with
+        the cursor of the next call.
+
+        Given the cursor of a previous call, only the answers and interviews
+        added since are counted, from their new rows, unless some answers
+        were changed or deleted in between, and then ``full`` is set and
+        everything is counted again, like ``results`` does, from the choice
+        tallies. The full counts also give the texts of the questions and
+        choices. The rows added during the last ``RESULTS_SETTLE_SECONDS``
+        are left to the next call, so that the transactions committing out
+        of the order of their ids are counted.
+        """
+        epoch = answers_epoch(self.id)
+        try:
+            since = [int(part) for part in cursor.split('.')]
+            full = len(since) != 3 or since[0] != epoch
+        except (AttributeError, ValueError):
+            full = True
+        settled = datetime.datetime.now() - datetime.timedelta(
+            seconds=RESULTS_SETTLE_SECONDS)
+        if full:
+            return self._full_results(epoch, settled)
+        answer_id, interview_id = since[1:]
+        answers = Answer.objects.filter(question__survey=self.id,
+                                        id__gt=answer_id)
+        interviews = self.interviews.filter(id__gt=interview_id)
+        answer_upto = answers.filter(submission_date__lte=settled)\
+                             .aggregate(Max('id'))['id__max'] or answer_id
+        interview_upto = interviews.filter(started__lte=settled)\
+                                   .aggregate(Max('id'))['id__max'] or \
+                         interview_id
+
+        questions = {}
+        order = []
+        if answer_upto > answer_id:
+            for question_id, choice_id, count in answers\
+                    .filter(id__lte=answer_upto)\
+                    .values_list('question', 'choice')\
+                    .annotate(Count('id')).order_by():
+                if question_id not in questions:
+                    questions[question_id] = {'id': question_id,
+                                              'answer_count': 0,
+                                              'choices': {}}
+                    order.append(question_id)
+                question = questions[question_id]
+                question['answer_count'] += count
+                if choice_id is not None:
+                    question['choices'].setdefault(choice_id,
+                        {'id': choice_id, 'count': 0})['count'] += count
+        interview_count = 0
+        if interview_upto > interview_id:
+            interview_count = interviews.filter(id__lte=interview_upto)\
+                                        .count()
+        for question in questions.values():
+            question['choices'] = sorted(question['choices'].values(),
+                                         key=lambda choice: choice['id'])
+        return {'survey': self.slug,
+                'full': False,
+                'cursor': '%s.%d.%d' % (epoch, answer_upto, interview_upto),
+                'interview_count': interview_count,
+                'questions': [questions[id] for id in order]}
+
+    def _full_results(self, epoch, settled):
+        """
+        The full counts of ``results_since``, up to the first answer and
+        interview added after ``settled``. The answers after it, the only
+        ones read, are taken out of the tallies.
+        """
+        answers = Answer.objects.filter(question__survey=self.id)
+        answer_upto = _settled_upto(answers, 'submission_date', settled)
+        interview_upto = _settled_upto(self.interviews.all(), 'started',
+                                       settled)
+        counts = dict(answers.exclude(question__qtype__in=CHOICE_QTYPES)
+                      .filter(id__lte=answer_upto).values_list('question')
+                      .annotate(Count('id')).order_by())
+        tallies = dict(ChoiceTally.objects.filter(question__survey=self.id)
+                       .values_list('choice', 'count'))
+        for choice_id, count in answers.filter(id__gt=answer_upto,
+                                               choice__isnull=False)\
+                                       .values_list('choice')\
+                                       .annotate(Count('id')).order_by():
+            tallies[choice_id] = tallies.get(choice_id, 0) - count
+
+        questions = {}
+        order = []
+        for question in self.questions.all():
+            questions[question.id] = {'id': question.id,
+                                      'text': question.text,
+                                      'qtype': question.qtype,
+                                      'answer_count': counts.get(question.id,
+                                                                 0),
+                                      'choices': []}
+            order.append(question.id)
+        for choice in Choice.objects.filter(question__survey=self.id):
+            question = questions[choice.question_id]
+            count = tallies.get(choice.id, 0)
+            question['choices'].append({'id': choice.id, 'text': choice.text,
+                                        'count': count})
+            question['answer_count'] += count
+        for question in questions.values():
+            question['choices'].sort(key=lambda choice: choice['id'])
+        return {'survey': self.slug,
+                'full': True,
+                'cursor': '%s.%d.%d' % (epoch, answer_upto, interview_upto),
+                'interview_count': self.interviews.filter(
+                                       id__lte=interview_upto).count(),
+                'questions': [questions[id] for id in order]}
+
+    def cached_results(self):
+        """
+        Same as ``results``, served from the cache until the results version
+        of the survey changes, and recomputed at most every
+        ``SURVEY_RESULTS_MIN_REFRESH`` seconds.
+
+        The results are computed on the database being read, the replica in
+        the views reading from it. As the replica may then miss the answers
+        of the last SURVEY_PRIMARY_STICKY_SECONDS, results computed there
+        within that delay of the last change of the version are computed
+        again once it has passed.
+        """
+        key = 'survey_%d_results' % self.id
+        version = results_version(self.id)
+        entry = cache.get(key)
+        now = time.time()
+        if (entry is None or
+            ((entry['version'] != version or
+              (entry.get('recompute_at') is not None and
+               now >= entry['recompute_at'])) and
+             now - entry['time'] >= RESULTS_MIN_REFRESH)):
+            recompute_at = None
+            if routers.reading_from_replica():
+                bumped = results_bumped(self.id)
+                if now - bumped < routers.STICKY_SECONDS:
+                    recompute_at = bumped + routers.STICKY_SECONDS
+            entry = {'version': version,
+                     'time': now,
+                     'recompute_at': recompute_at,
+                     'questions': self.results(),
+                     'answer_count': self._answer_count,
+                     'interview_count': self._interview_count,
+                     'session_key_count': self._session_key_count}
+            cache.set(key, entry, CACHE_TIMEOUT)
+            metrics.results_cache.inc(result='miss')
+        else:
+            metrics.results_cache.inc(result='hit')
+            self._answer_count = entry['answer_count']
+            self._interview_count = entry['interview_count']
+            self._session_key_count = entry['session_key_count']
+        return entry['questions']
 
 
 
@@ -145,8 +518,16 @@ class Survey(models.Model):
         return ('survey-detail', (), {'survey_slug': self.slug })
 
     def save(self):
+        # The interviews submitted while the survey accepted several are
+        # claimed once it accepts a single one.
+        claim = (self.id and not self.allows_multiple_interviews and
+                 Survey.objects.filter(id=self.id,
+                                       allows_multiple_interviews=True)
+                               .exists())
         res = super(Survey, self).save()
         cache.delete(self._cache_name)
+        if claim:
+            Interview.objects.claim_first(self.id)
         return res
 
     def answers_viewable_by(self, user):
@@ -185,10 +566,50 @@ class Question(models.Model):
     def answer_count(self):
         if hasattr(self, '_answer_count'):
             return self._answer_count
-        self._answer_count = self.answers.count()
+        if self.qtype in CHOICE_QTYPES:
+            # Every choice answer is counted in the tally of its choice.
+            self._answer_count = self.tallies.aggregate(
+                total=Sum('count'))['total'] or 0
+        else:
+            self._answer_count = self.answers.count()
         return self._answer_count
 
 
+    def answer_page(self, after=None, start=0, size=ANSWER_PAGE_SIZE):
+        """
+        Load in ``answer_list`` the ``size`` answers following the ``after``
+        cursor, or the first ones when it is None, and return them.
+
+        The answers are ordered by (submission_date, id) and a page starts
+        right after the key of the previous one instead of skipping an
+        OFFSET, so every page costs the same to fetch. ``next_cursor`` is
+        set to the cursor of the next page, or None on the last page, and
+        ``answer_start``/``next_start`` to the number of answers before
+        this page and the next one.
+
+        Raise ValueError when the cursor is invalid.
+        """
+        answers = self.answers.order_by('submission_date', 'id')
+        if after:
+            date, id = after.split('_')
+            date = datetime.datetime.strptime(date, '%Y%m%d%H%M%S%f')
+            answers = answers.filter(Q(submission_date__gt=date) |
+                                     Q(submission_date=date, id__gt=int(id)))
+        return self._set_page(list(answers[:size + 1]), start, size)
+
+    def _set_page(self, answers, start, size):
+        "Load a page of at most ``size`` of ``answers``, fetched with one more."
+        self.next_cursor = None
+        if len(answers) > size:
+            answers = answers[:size]
+            last = answers[-1]
+            self.next_cursor = '%s_%d' % (
+                last.submission_date.strftime('%Y%m%d%H%M%S%f'), last.id)
+        self.answer_list = answers
+        self.answer_start = start
+        self.next_start = start + len(answers)
+        return answers
+
     def __unicode__(self):
         return u' - '.join([self.survey.slug, self.text])
 
@@ -213,6 +634,22 @@ class Question(models.Model):
     def choice_count(self):
         return self.choices.count()
 
+class ChoiceQuerySet(QuerySet):
+
+    def delete(self):
+        # Bulk deletes, from the admin actions among others, keep the answers
+        # like ``Choice.delete``; a pre_delete handler would run after the
+        # answers were collected for the cascade.
+        choice_ids = list(self.values_list('id', flat=True))
+        Answer.objects.filter(choice__in=choice_ids).update(choice=None)
+        super(ChoiceQuerySet, self).delete()
+    delete.alters_data = True
+
+class ChoiceManager(models.Manager):
+
+    def get_query_set(self):
+        return ChoiceQuerySet(self.model, using=self._db)
+
 class Choice(models.Model):
     ## validate question is of proper qtype
     question = models.ForeignKey(Question, related_name='choices',
@@ -227,6 +664,8 @@ class Choice(models.Model):
     order = models.IntegerField(verbose_name = _("order"),
                                 null=True, blank=True)
 
+    objects = ChoiceManager()
+
     @models.permalink
     def get_update_url(self):
         return ('choice-update', (), {'question_id': self.question.id,'choice_id' :self.id  })
@@ -235,18 +674,346 @@ class Choice(models.Model):
     def count(self):
         if hasattr(self, '_count'):
             return self._count
-        self._count = Answer.objects.filter(question=self.question_id,
-                                            text=self.text).count()
+        counts = list(self.tallies.values_list('count', flat=True)[:1])
+        self._count = counts and counts[0] or 0
         return self._count
 
     def __unicode__(self):
         return self.text
 
+    def save(self, *args, **kwargs):
+        created = not self.id
+        res = super(Choice, self).save(*args, **kwargs)
+        if created:
+            ChoiceTally.objects.get_or_create(question_id=self.question_id,
+                                              choice=self)
+        return res
+
+    def delete(self):
+        # Keep the answers which selected the choice, the answer text is
+        # enough to display them.
+        Answer.objects.filter(choice=self.id).update(choice=None)
+        super(Choice, self).delete()
+
     class Meta:
         unique_together = (('question', 'text'),)
         order_with_respect_to='question'
         ordering = ('question', 'order')
 
+class ChoiceTallyManager(models.Manager):
+
+    def add(self, question, choice_id, delta=1):
+        """
+        Add ``delta`` votes to the tally of a choice. This must be called
+        in the transaction writing the answers it accounts for.
+        """
+        updated = self.filter(question=question, choice=choice_id)\
+                      .update(count=F('count') + delta)
+        if not updated:
+            self.create(question=question, choice_id=choice_id, count=delta)
+
+    def rebuild(self, survey):
+        """
+        Recompute from the answers the tallies of every choice of a survey.
+        The answers saved before they referenced their choice are only counted
+        once linked with ``Answer.objects.link_choices``, see
+        ``Answer.objects.unlinked``.
+        """
+        counts = dict(Answer.objects.filter(question__survey=survey.id,
+                                            choice__isnull=False)
+                      .values_list('choice').annotate(Count('id')).order_by())
+        self.filter(question__survey=survey.id).delete()
+        for choice in Choice.objects.filter(question__survey=survey.id):
+            self.create(question_id=choice.question_id, choice=choice,
+                        count=counts.get(choice.id, 0))
+        bump_results_version(survey.id)
+
+    def add_many(self, changes):
+        """
+        Apply the deltas of ``changes``, a dictionary mapping (question id,
+        choice id) to a number of votes, with one UPDATE per distinct delta.
+        This must be called in the transaction writing the answers it
+        accounts for.
+        """
+        by_delta = {}
+        for key, delta in changes.iteritems():
+            if delta:
+                by_delta.setdefault(delta, []).append(key)
+        for delta, keys in by_delta.iteritems():
+            choice_ids = [choice_id for question_id, choice_id in keys]
+            updated = self.filter(choice__in=choice_ids)\
+                          .update(count=F('count') + delta)
+            if updated < len(keys):
+                existing = set(self.filter(choice__in=choice_ids)
+                               .values_list('choice', flat=True))
+                for question_id, choice_id in keys:
+                    if int(choice_id) not in existing:
+                        self.create(question_id=question_id,
+                                    choice_id=choice_id, count=delta)
+
+class ChoiceTally(models.Model):
+    """
+    Number of answers that selected a choice, maintained when the answers
+    are saved so that the results never have to scan the answers.
+    """
+    question = models.ForeignKey(Question, related_name='tallies',
+                                 verbose_name=_('question'), editable=False)
+    choice = models.ForeignKey(Choice, related_name='tallies',
+                               verbose_name=_('choice'), editable=False)
+    count = models.IntegerField(_('number of answers'), default=0)
+
+
+    objects = ChoiceTallyManager()
+
+    def __unicode__(self):
+        return u'%s: %d' % (self.choice_id, self.count)
+
+    class Meta:
+        unique_together = (('question', 'choice'),)
+
+class InterviewClaimed(Exception):
+    "Raised when a survey accepting one interview is answered again."
+
+class InterviewManager(models.Manager):
+
+    def record(self, survey_id, answer, single=False):
+        """
+        Return the interview of a submission, whose first answer is
+        ``answer``, creating it on the first submission and marking it
+        submitted again, by the session of ``answer``, when its answers are
+        edited. This must be called in
+        the transaction writing the answers, before writing them.
+
+        With ``single``, the new interview claims the survey for the user of
+        the answer, or its session key when anonymous, and
+        ``InterviewClaimed`` is raised, leaving the transaction to be rolled
+        back, if it was already claimed.
+        """
+        try:
+            interview = self.get(uuid=answer.interview_uuid)
+        except self.model.DoesNotExist:
+            claim = single and self.claim_for(answer) or None
+            using = router.db_for_write(self.model)
+            sid = transaction.savepoint(using=using)
+            try:
+                interview = self.create(survey_id=survey_id,
+                                        uuid=answer.interview_uuid,
+                                        session_key=answer.session_key,
+                                        user_id=answer.user_id, claim=claim)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid, using=using)
+                if claim and self.filter(survey=survey_id,
+                                         claim=claim).exists():
+                    raise InterviewClaimed(survey_id, claim)
+                raise
+            transaction.savepoint_commit(sid, using=using)
+            return interview
+        # The respondent may edit their answers from another session, whose
+        # key the answers take.
+        interview.session_key = answer.session_key
+        if answer.user_id:
+            interview.user_id = answer.user_id
+        interview.save()
+        return interview
+
+    def claim_for(self, answer):
+        """
+        Return the claim of the respondent of an answer, or of an
+        interview, on a survey.
+        """
+        if answer.user_id:
+            return 'user:%d' % answer.user_id
+        return answer.session_key
+
+    def claim_first(self, survey_id):
+        """
+        Make the first interview of each respondent of a survey claim it,
+        unless they already claimed it, so that the respondents who answered
+        before the survey accepted a single interview, or before interviews
+        were claimed, cannot answer again. Return the number of interviews
+        claimed.
+        """
+        interviews = self.filter(survey=survey_id)
+        claimed = set(interviews.filter(claim__isnull=False)
+                      .values_list('claim', flat=True))
+        count = 0
+        for interview in interviews.filter(claim__isnull=True)\
+                                   .order_by('started', 'id'):
+            claim = self.claim_for(interview)
+            if claim and claim not in claimed:
+                claimed.add(claim)
+                self.filter(id=interview.id).update(claim=claim)
+                count += 1
+        return count
+
+    def backfill(self):
+        """
+        Create the interviews of the answers saved before interviews were
+        recorded and link the answers to them. The answers without an
+        interview uuid, or sharing one with another survey, are given a new
+        one. The surveys accepting a single interview are then claimed, see
+        ``claim_first``. Return the number of interviews created.
+        """
+        answers = Answer.objects.filter(interview__isnull=True)
+        groups = answers.values_list('interview_uuid', 'question__survey',
+                                     'session_key', 'user')\
+                        .annotate(models.Min('submission_date'),
+                                  models.Max('submission_date')).order_by()
+        used = set(self.values_list('uuid', flat=True))
+        created = 0
+        for uuid, survey_id, session_key, user_id, started, submitted in groups:
+            group = answers.filter(interview_uuid=uuid,
+                                   question__survey=survey_id,
+                                   session_key=session_key, user=user_id)
+            if not uuid or uuid in used:
+                uuid = uuid4().hex
+                Answer.objects.filter(id__in=list(group.values_list(
+                    'id', flat=True))).update(interview_uuid=uuid)
+                group = answers.filter(interview_uuid=uuid)
+            used.add(uuid)
+            interview = self.create(survey_id=survey_id, uuid=uuid,
+                                    session_key=session_key, user_id=user_id)
+            # auto_now_add and auto_now stamp the creation date.
+            self.filter(id=interview.id).update(started=started,
+                                                submitted=submitted)
+            Answer.objects.filter(id__in=list(group.values_list(
+                'id', flat=True))).update(interview=interview)
+            bump_results_version(survey_id)
+            created += 1
+        for survey_id in Survey.objects.filter(
+                allows_multiple_interviews=False).values_list('id', flat=True):
+            self.claim_first(survey_id)
+        return created
+
+class Interview(models.Model):
+    """
+    A submission of a survey by a respondent. The answers of the submission
+    share its ``uuid`` and reference it, so that the respondents of a survey
+    are found without scanning its answers.
+    """
+    survey = models.ForeignKey(Survey, related_name='interviews',
+                               verbose_name=_('survey'), editable=False)
+    uuid = models.CharField(_("Interview unique identifier"), max_length=36,
+                            unique=True, editable=False)
+    ## sessions expire, survey results do not, so keep the key.
+    session_key = models.CharField(_('session key'), max_length=40,
+                                   editable=False)
+    user = models.ForeignKey(User, related_name='interviews',
+                             verbose_name=_('user'), editable=False,
+                             blank=True, null=True)
+    started = models.DateTimeField(_('started'), auto_now_add=True)
+    submitted = models.DateTimeField(_('submitted'), auto_now=True)
+
+    # The respondent of the surveys accepting a single interview, see
+    # ``InterviewManager.claim_for``, unique per survey, so that concurrent
+    # submissions of the same respondent cannot both be saved.
+    claim = models.CharField(_('claim'), max_length=40, editable=False,
+                             null=True, blank=True)
+
+    # The (survey, session_key) and (survey, user) indexes are created by
+    # sql/interview.sql.
+    objects = InterviewManager()
+
+    def __unicode__(self):
+        return self.uuid
+
+    class Meta:
+        unique_together = (('survey', 'claim'),)
+
+class AnswerManager(models.Manager):
+
+    # Questions per UNION of ``first_pages``, under the limit of 500 terms
+    # of a compound SELECT of SQLite.
+    first_pages_batch_size = 100
+
+    def first_pages(self, question_ids, size):
+        """
+        Return the first ``size`` answers of each question of
+        ``question_ids`` in the (submission_date, id) order, keyed by
+        question id, with one query for up to ``first_pages_batch_size``
+        questions: a UNION of a bounded query per question.
+        """
+        using = router.db_for_read(self.model)
+        qn = connections[using].ops.quote_name
+        opts = self.model._meta
+        page = u'SELECT * FROM (SELECT %s FROM %s WHERE %s = %%s ' \
+               u'ORDER BY %s, %s LIMIT %d) ' % (
+            u', '.join([qn(f.column) for f in opts.local_fields]),
+            qn(opts.db_table), qn(opts.get_field('question').column),
+            qn(opts.get_field('submission_date').column),
+            qn(opts.pk.column), int(size))
+        pages = {}
+        for start in range(0, len(question_ids), self.first_pages_batch_size):
+            batch = question_ids[start:start + self.first_pages_batch_size]
+            sql = u' UNION ALL '.join([page + qn('page%d' % i)
+                                       for i in range(len(batch))])
+            for answer in self.raw(sql, batch).using(using):
+                pages.setdefault(answer.question_id, []).append(answer)
+        for answers in pages.values():
+            answers.sort(key=lambda answer: (answer.submission_date,
+                                             answer.id))
+        return pages
+
+    def link_choices(self, survey=None):
+        """
+        Make the answers to the choice questions of a survey, or of every
+        survey, which only store the text of their choice reference it.
+        Return the number of answers linked.
+        """
+        choices = Choice.objects.all()
+        if survey is not None:
+            choices = choices.filter(question__survey=survey.id)
+        linked = 0
+        for choice_id, question_id, text, survey_id in choices.values_list(
+                'id', 'question', 'text', 'question__survey'):
+            count = self.filter(question=question_id, text=text,
+                                choice__isnull=True).update(choice=choice_id)
+            if count:
+                bump_answers_epoch(survey_id)
+            linked += count
+        return linked
+
+    def unlinked(self, survey):
+        """
+        Return the answers of a survey which only store the text of a choice
+        of their question, and which ``link_choices`` would link. The
+        answers of deleted choices are not.
+        """
+        return self.filter(question__survey=survey.id, choice__isnull=True,
+                           question__choices__text=F('text'))
+
+    # Rows per INSERT statement, small enough to stay under the limit of
+    # 999 parameters per statement of SQLite.
+    insert_batch_size = 100
+
+    def insert_many(self, answers):
+        """
+        Insert new answers with multi-row INSERT statements. No signal is
+        sent and the ids of the answers are not set. This must be called
+        inside a transaction.
+        """
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        fields = [f for f in opts.local_fields
+                  if not isinstance(f, models.AutoField)]
+        row = u'(%s)' % u', '.join([u'%s'] * len(fields))
+        cursor = connection.cursor()
+        for start in range(0, len(answers), self.insert_batch_size):
+            batch = answers[start:start + self.insert_batch_size]
+            params = []
+            for answer in batch:
+                params.extend(f.get_db_prep_save(f.pre_save(answer, True),
+                                                 connection=connection)
+                              for f in fields)
+            cursor.execute(u'INSERT INTO %s (%s) VALUES %s' % (
+                qn(opts.db_table),
+                u', '.join([qn(f.column) for f in fields]),
+                u', '.join([row] * len(batch))), params)
+        if answers:
+            transaction.set_dirty(using=using)
+
 class Answer(models.Model):
     user = models.ForeignKey(User, related_name='answers',
                              verbose_name=_('user'), editable=False,
@@ -260,9 +1027,64 @@ class Answer(models.Model):
     submission_date = models.DateTimeField(auto_now=True)
     # UUID is used to calculate the number of interviews
     interview_uuid = models.CharField(_("Interview unique identifier"),max_length=36)
+    interview = models.ForeignKey(Interview, related_name='answers',
+                                  verbose_name=_('interview'), editable=False,
+                                  blank=True, null=True)
+    # The selected choice of the answers to choice questions, whose text is
+    # also kept in ``text``.
+    choice = models.ForeignKey(Choice, related_name='answers',
+                               verbose_name=_('choice'), editable=False,
+                               blank=True, null=True)
+
+    objects = AnswerManager()
 
 
     class Meta:
         # unique_together = (('question', 'session_key'),)
         permissions = (("view_answers",     "Can view survey answers"),
                        ("view_submissions", "Can view survey submissions"))
+
+def _bump_versions(sender, instance, **kwargs):
+    """
+    Invalidate the cached results, and for questions and choices the cached
+    schema, of the survey of a saved or deleted object. Changing or deleting
+    an answer, or deleting a choice, starts a new answers epoch.
+    """
+    try:
+        if isinstance(instance, Question):
+            survey_id = instance.survey_id
+        else:
+            survey_id = instance.question.survey_id
+    except Question.DoesNotExist:
+        # Deleted along with its question, which bumps the versions itself.
+        return
+    bump_results_version(survey_id)
+    if sender is not Answer:
+        bump_schema_version(survey_id)
+    deleted = kwargs['signal'] is post_delete
+    if ((sender is Answer and not kwargs.get('created')) or
+        (sender is Choice and deleted)):
+        bump_answers_epoch(survey_id)
+
+def _untally_answer(sender, instance, **kwargs):
+    """
+    Take a deleted answer out of the tally of its choice, whatever deleted
+    it: the answer forms, the admin or the deletion of its interview.
+    """
+    if instance.choice_id is not None:
+        # No tally is created: it was deleted along with its choice.
+        ChoiceTally.objects.filter(choice=instance.choice_id)\
+                           .update(count=F('count') - 1)
+
+def _bump_answers_epoch(sender, instance, **kwargs):
+    "Start a new answers epoch for the survey of a deleted interview."
+    bump_answers_epoch(instance.survey_id)
+
+post_save.connect(_bump_versions, sender=Answer)
+post_delete.connect(_bump_versions, sender=Answer)
+post_delete.connect(_untally_answer, sender=Answer)
+post_save.connect(_bump_versions, sender=Question)
+post_delete.connect(_bump_versions, sender=Question)
+post_save.connect(_bump_versions, sender=Choice)
+post_delete.connect(_bump_versions, sender=Choice)
+post_delete.connect(_bump_answers_epoch, sender=Interview)
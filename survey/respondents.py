@@ -0,0 +1,105 @@
+"""Survey Respondents
+
+The key identifying the answers of a respondent and the surveys they have
+answered. By default the key is the session key and the answered surveys
+are looked up in the database. When the SURVEY_RESPONDENT_COOKIE setting
+names a cookie, both are kept in that cookie, signed with the SECRET_KEY,
+so that browsing the surveys reads and writes no session.
+"""
+import hashlib
+import hmac
+import uuid
+
+from django.conf import settings
+
+
+COOKIE_NAME = getattr(settings, 'SURVEY_RESPONDENT_COOKIE', None)
+
+# Lifetime, in seconds, of the respondent cookie.
+COOKIE_AGE = getattr(settings, 'SURVEY_RESPONDENT_COOKIE_AGE',
+                     60*60*24*365)
+
+
+def cookie_enabled():
+    return bool(COOKIE_NAME)
+
+def _signature(value):
+    return hmac.new(hashlib.sha1('survey.respondents' +
+                                 settings.SECRET_KEY).digest(),
+                    value, hashlib.sha1).hexdigest()
+
+def _same(a, b):
+    "Compare two strings in a time independent of their common prefix."
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+def sign(key, answered):
+    "Return the cookie value of a respondent key and answered survey ids."
+    value = '%s:%s' % (key, ','.join([str(id) for id in sorted(answered)]))
+    return '%s:%s' % (value, _signature(value))
+
+def unsign(token):
+    """
+    Return the respondent key and the set of answered survey ids of a cookie
+    value, or None when it was not signed by ``sign``.
+    """
+    try:
+        value, signature = str(token).rsplit(':', 1)
+        key, ids = value.split(':')
+        answered = set([int(id) for id in ids.split(',') if id])
+    except (UnicodeEncodeError, ValueError):
+        return None
+    if not key or not _same(signature, _signature(value)):
+        return None
+    return key, answered
+
+class Respondent(object):
+    """
+    The respondent of a request. ``answered`` is the set of the ids of the
+    surveys they answered when kept in the cookie, or else None.
+    """
+    def __init__(self, key, answered=None):
+        self.key = key
+        self.answered = answered
+        # Whether the cookie must be sent again.
+        self.changed = False
+
+    def has_answered(self, survey):
+        if self.answered is not None:
+            return survey.id in self.answered
+        return bool(self.key) and survey.has_answers_from(self.key)
+
+    def add_answered(self, survey):
+        "Remember that the respondent answered a survey."
+        if self.answered is not None and survey.id not in self.answered:
+            self.answered.add(survey.id)
+            self.changed = True
+
+def get_respondent(request):
+    "Return the respondent of a request, read once per request."
+    if not hasattr(request, '_survey_respondent'):
+        if cookie_enabled():
+            token = unsign(request.COOKIES.get(COOKIE_NAME, ''))
+            if token is None:
+                respondent = Respondent(uuid.uuid4().hex, set())
+                respondent.changed = True
+            else:
+                respondent = Respondent(*token)
+        elif hasattr(request, 'session'):
+            respondent = Respondent(request.session.session_key.lower())
+        else:
+            respondent = Respondent(None)
+        request._survey_respondent = respondent
+    return request._survey_respondent
+
+def set_cookie(response, respondent):
+    "Send the respondent cookie when it changed."
+    if cookie_enabled() and respondent.changed:
+        response.set_cookie(COOKIE_NAME,
+                            sign(respondent.key, respondent.answered),
+                            max_age=COOKIE_AGE)
+    return response
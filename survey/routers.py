@@ -0,0 +1,94 @@
+"""Survey Database Router
+
+Send the reads of the survey browsing views to a read replica. Add
+``'survey.routers.SurveyRouter'`` to DATABASE_ROUTERS and name the replica
+alias in the SURVEY_READ_DATABASE setting. The views decorated with
+``reads_from_replica`` then read the survey models from the replica, and
+everything else keeps using the default database.
+
+A respondent who just submitted answers gets a cookie sticking their reads
+to the default database for SURVEY_PRIMARY_STICKY_SECONDS, so that the
+pages they are redirected to never miss the answers not replicated yet.
+"""
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import wraps
+
+
+READ_DATABASE = getattr(settings, 'SURVEY_READ_DATABASE', None)
+
+STICKY_SECONDS = getattr(settings, 'SURVEY_PRIMARY_STICKY_SECONDS', 10)
+
+STICKY_COOKIE = 'survey_primary'
+
+_state = threading.local()
+
+
+def _is_survey_model(model):
+    return model._meta.app_label == 'survey'
+
+class SurveyRouter(object):
+    """
+    Route the reads of the survey models to READ_DATABASE inside the views
+    decorated with ``reads_from_replica``, and everywhere else to the
+    default database, even for the objects related to an object read from
+    the replica. Their writes always go to the default database.
+    """
+    def db_for_read(self, model, **hints):
+        if _is_survey_model(model):
+            return getattr(_state, 'replica', None) or DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if _is_survey_model(model):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the default database.
+        if _is_survey_model(obj1) or _is_survey_model(obj2):
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        return None
+
+def reading_from_replica():
+    "Whether the survey models are being read from READ_DATABASE."
+    return bool(getattr(_state, 'replica', None))
+
+def reads_from_replica(view):
+    """
+    Decorator making a view read the survey models from READ_DATABASE,
+    unless the client is sticking to the default database.
+    """
+    def wrapper(request, *args, **kwargs):
+        if READ_DATABASE and STICKY_COOKIE not in request.COOKIES:
+            _state.replica = READ_DATABASE
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _state.replica = None
+    return wraps(view)(wrapper)
+
+def reads_from_primary(function):
+    """
+    Decorator making a function read from the default database, even
+    inside a view reading from the replica.
+    """
+    def wrapper(*args, **kwargs):
+        replica = getattr(_state, 'replica', None)
+        _state.replica = None
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _state.replica = replica
+    return wraps(function)(wrapper)
+
+def stick_to_primary(response):
+    "Make the next reads of the client use the default database for a while."
+    if READ_DATABASE:
+        response.set_cookie(STICKY_COOKIE, '1', max_age=STICKY_SECONDS)
+    return response
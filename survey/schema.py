@@ -0,0 +1,91 @@
+"""Survey Schema
+
+The questions of a survey and their choices, compiled once per schema
+version and kept both in an in-process LRU and in the Django cache, so that
+building the forms of a survey costs no query until one of its questions or
+choices changes.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.datastructures import SortedDict
+
+from survey.models import Question, Choice, CACHE_TIMEOUT, schema_version
+
+
+# Number of compiled schemas kept in the memory of each process.
+SCHEMA_LRU_SIZE = getattr(settings, 'SURVEY_SCHEMA_LRU_SIZE', 100)
+
+
+class CompiledQuestion(object):
+    """
+    A question with the (id, text, image url) tuples of its choices, in
+    order, and the map from the id of a choice to its text. The ids are
+    strings as posted by the answer forms.
+
+    Compiled questions are shared between requests and must not be
+    modified.
+    """
+    def __init__(self, question, choices):
+        self.question = question
+        self.choices = tuple((str(choice.id), choice.text,
+                              choice.image and choice.image.url or None)
+                             for choice in choices)
+        self.choices_dict = dict((key, text)
+                                 for key, text, image_url in self.choices)
+
+def compile_schema(survey):
+    "Return the tuple of the compiled questions of a survey, in order."
+    choices = {}
+    for choice in Choice.objects.filter(question__survey=survey.id)\
+            .order_by('order'):
+        choices.setdefault(choice.question_id, []).append(choice)
+    return tuple(CompiledQuestion(question, choices.get(question.id, ()))
+                 for question in Question.objects.filter(survey=survey.id)
+                                                 .order_by('order'))
+
+class LRU(object):
+    "Thread safe mapping keeping only the ``size`` most recently used keys."
+    def __init__(self, size):
+        self.size = size
+        self.items = SortedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.items[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                del self.items[self.items.keyOrder[0]]
+        finally:
+            self.lock.release()
+
+_schemas = LRU(SCHEMA_LRU_SIZE)
+
+def get_schema(survey):
+    """
+    Return the compiled questions of a survey from the process memory, the
+    Django cache or the database, in that order.
+    """
+    key = (survey.id, schema_version(survey.id))
+    schema = _schemas.get(key)
+    if schema is None:
+        cache_key = 'survey_%d_schema_%s' % key
+        schema = cache.get(cache_key)
+        if schema is None:
+            schema = compile_schema(survey)
+            cache.set(cache_key, schema, CACHE_TIMEOUT)
+        _schemas.set(key, schema)
+    return schema
@@ -0,0 +1,143 @@
+"""Submission Spool
+
+Optional asynchronous ingestion of the submissions. When the
+SURVEY_SUBMISSION_SPOOL setting names a file, survey_detail appends the
+validated answers of each submission to that SQLite append log instead of
+writing them to the database, and the drain_submissions command inserts
+them in batches.
+
+Delivery is at least once: a submission only leaves the spool once its
+answers are committed, and the submissions whose interview is already
+recorded are skipped, so that a batch drained twice is only inserted once.
+"""
+import sqlite3
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import simplejson
+
+from survey.forms import collect_answers
+from survey.models import Answer, ChoiceTally, Interview, Question,\
+                          bump_results_version
+
+
+SPOOL_PATH = getattr(settings, 'SURVEY_SUBMISSION_SPOOL', None)
+
+# Number of submissions inserted per transaction by ``drain``.
+DRAIN_BATCH_SIZE = 100
+
+
+def enabled():
+    return bool(SPOOL_PATH)
+
+def _connect(path=None):
+    connection = sqlite3.connect(path or SPOOL_PATH, timeout=30)
+    connection.execute('CREATE TABLE IF NOT EXISTS submission ('
+                       'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'interview_uuid TEXT NOT NULL UNIQUE, '
+                       'survey_id INTEGER NOT NULL, '
+                       'spooled REAL NOT NULL, '
+                       'payload TEXT NOT NULL)')
+    return connection
+
+def spool_answers(forms, path=None):
+    """
+    Append the new answers of the valid answer forms of a submission, and
+    the tally changes they imply, to the spool.
+    """
+    answers, tallies = collect_answers(forms)
+    if not answers:
+        return
+    payload = simplejson.dumps({
+        'answers': [(ans.question_id, ans.user_id, ans.session_key, ans.text,
+                     ans.choice_id) for ans in answers],
+        'tallies': [(question_id, choice_id, delta) for
+                    (question_id, choice_id), delta in tallies.iteritems()],
+    })
+    connection = _connect(path)
+    try:
+        # A submission spooled twice is only kept once.
+        connection.execute('INSERT OR IGNORE INTO submission '
+                           '(interview_uuid, survey_id, spooled, payload) '
+                           'VALUES (?, ?, ?, ?)',
+                           (answers[0].interview_uuid,
+                            forms[0].question.survey_id, time.time(),
+                            payload))
+        connection.commit()
+    finally:
+        connection.close()
+
+@transaction.commit_on_success
+def _insert_submissions(rows):
+    uuids = [row[1] for row in rows]
+    inserted = set(Interview.objects.filter(uuid__in=uuids)
+                   .values_list('uuid', flat=True))
+    submissions = [(uuid, survey_id, simplejson.loads(payload))
+                   for id, uuid, survey_id, payload in rows
+                   if uuid not in inserted]
+    # The answers to questions deleted since the submission are dropped.
+    question_ids = set(Question.objects.filter(id__in=set(
+        answer[0] for uuid, survey_id, payload in submissions
+        for answer in payload['answers'])).values_list('id', flat=True))
+    answers = []
+    tallies = {}
+    for uuid, survey_id, payload in submissions:
+        interview = None
+        for answer in payload['answers']:
+            question_id, user_id, session_key, text = answer[:4]
+            # Submissions spooled before the answers referenced their
+            # choice have no choice id.
+            choice_id = len(answer) > 4 and answer[4] or None
+            if question_id in question_ids:
+                if interview is None:
+                    interview = Interview.objects.create(
+                        survey_id=survey_id, uuid=uuid,
+                        session_key=session_key, user_id=user_id)
+                answers.append(Answer(question_id=question_id, user_id=user_id,
+                                      session_key=session_key,
+                                      interview_uuid=uuid, interview=interview,
+                                      choice_id=choice_id, text=text))
+        for question_id, choice_id, delta in payload['tallies']:
+            if question_id in question_ids:
+                key = (question_id, choice_id)
+                tallies[key] = tallies.get(key, 0) + delta
+    Answer.objects.insert_many(answers)
+    ChoiceTally.objects.add_many(tallies)
+
+def drain(batch_size=DRAIN_BATCH_SIZE, path=None):
+    """
+    Insert the oldest ``batch_size`` spooled submissions in the database
+    and remove them from the spool. Return the number of submissions
+    drained.
+    """
+    connection = _connect(path)
+    try:
+        rows = connection.execute('SELECT id, interview_uuid, survey_id, '
+                                  'payload FROM submission ORDER BY id '
+                                  'LIMIT ?', (batch_size,)).fetchall()
+        if not rows:
+            return 0
+        _insert_submissions(rows)
+        for survey_id in set(row[2] for row in rows):
+            bump_results_version(survey_id)
+        connection.execute('DELETE FROM submission WHERE id <= ?',
+                           (rows[-1][0],))
+        connection.commit()
+        return len(rows)
+    finally:
+        connection.close()
+
+def stats(path=None):
+    """
+    Return the number of submissions waiting in the spool and the lag, in
+    seconds, of the oldest one.
+    """
+    connection = _connect(path)
+    try:
+        pending, oldest = connection.execute(
+            'SELECT COUNT(*), MIN(spooled) FROM submission').fetchone()
+    finally:
+        connection.close()
+    return {'pending': pending,
+            'lag': oldest is not None and time.time() - oldest or 0.0}
@@ -0,0 +1,4 @@
+CREATE INDEX survey_answer_question_choice ON survey_answer (question_id, choice_id);
+CREATE INDEX survey_answer_session_key ON survey_answer (session_key, question_id);
+CREATE INDEX survey_answer_question_submission ON survey_answer (question_id, submission_date, id);
+CREATE INDEX survey_answer_interview_uuid ON survey_answer (interview_uuid, id);
@@ -0,0 +1,2 @@
+CREATE INDEX survey_interview_survey_session_key ON survey_interview (survey_id, session_key);
+CREATE INDEX survey_interview_survey_user ON survey_interview (survey_id, user_id);
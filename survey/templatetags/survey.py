@@ -1,16 +1,32 @@
+from __future__ import absolute_import
+
 from django import template
 
+from survey.forms import render_forms as _render_forms
+from survey.respondents import get_respondent
+
 register = template.Library()
 
 @register.filter
 def has_answered(request, survey):
-    if not hasattr(request, 'session'): return False
-    return survey.has_answers_from(request.session.session_key)
+    if not request: return False
+    return get_respondent(request).has_answered(survey)
+
+@register.filter
+def respondent_key(request):
+    "The key of the answers of the respondent of ``request``."
+    if not request: return ''
+    return get_respondent(request).key or ''
 
 @register.filter
 def can_view_answers(user, survey):
     return survey.answers_viewable_by(user)
 
+@register.filter
+def render_forms(forms):
+    "Render the answer forms of a survey, see ``survey.forms.render_forms``."
+    return _render_forms(forms)
+
 @register.filter_function
 def order_by(queryset, args):
     args = [x.strip() for x in args.split(',')]
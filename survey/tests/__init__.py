@@ -1,10 +1,25 @@
 # TODO: Find out how to run configure the test framework to run the test on :
 # sqlite, mysql, postgresql if the db are installed
-from survey.tests import test_models, test_urls, test_images
+from django.db import connection
+
+from survey.tests import test_models, test_urls, test_images,\
+                         test_query_plans, test_routers, test_bench,\
+                         test_query_budgets, test_timings,\
+                         test_metrics, test_results_api
 
 #Define the doctest
 __test__ = {
     "models" : test_models.test_cases,
     "urls" : test_urls.test_cases,
     "images" : test_images.test_cases,
+    "routers" : test_routers.test_cases,
+    "bench" : test_bench.test_cases,
+    "query_budgets" : test_query_budgets.test_cases,
+    "timings" : test_timings.test_cases,
+    "metrics" : test_metrics.test_cases,
+    "results_api" : test_results_api.test_cases,
 }
+
+# The query plans are only checked on SQLite.
+if connection.settings_dict['ENGINE'].endswith('sqlite3'):
+    __test__["query_plans"] = test_query_plans.test_cases
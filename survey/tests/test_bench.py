@@ -0,0 +1,60 @@
+test_cases = r"""
+Test the benchmark scenarios on a small generated survey
+
+>>> from django.contrib.auth.models import User
+>>> from survey.bench import generate, percentile, run_scenarios, SCENARIOS
+>>> percentile([3, 1, 2, 4], 50), percentile([3, 1, 2, 4], 95)
+(2, 4)
+>>> surveys = generate(surveys=1, questions=5, interviews=3,
+...                    username='bench_test')
+>>> [(s.slug, s.questions.count(), s.interviews.count()) for s in surveys]
+[('bench-0', 5, 3)]
+>>> results = run_scenarios(surveys[0], repeat=2, username='bench_test')
+>>> sorted(results) == sorted(SCENARIOS)
+True
+>>> sorted(results['answers_list'])
+['mean_ms', 'p50_ms', 'p95_ms', 'queries']
+>>> surveys[0].interviews.count()
+5
+
+The load test flows answer the survey and follow the redirection, or browse
+the results
+
+>>> from survey.bench import LocalClient, respondent_flow, browse_flow,\
+...     load_report, check_interviews, _post_data
+>>> steps = []
+>>> respondent_flow(LocalClient(), surveys[0], _post_data(surveys[0]), steps)
+>>> browse_flow(LocalClient(), surveys[0], steps)
+>>> [(name, ok) for name, seconds, ok in steps]
+[('get_survey', True), ('post_answers', True), ('follow_redirect', True), ('browse_results', True)]
+>>> report = load_report(steps + [('get_survey', 0.1, False)], 2.0)
+>>> report['requests'], report['errors'], report['error_rate'], report['throughput']
+(5, 1, 0.2, 2.5)
+>>> report['steps']['get_survey']['errors'], report['steps']['post_answers']['errors']
+(1, 0)
+
+The interviews are checked once the load is over. A respondent answering
+again a survey accepting a single interview is a duplicate, as the
+benchmark respondent who posted twice, and an interview without the answer
+to a required question is partial
+
+>>> check_interviews(surveys[0])
+{'duplicate': [], 'partial': []}
+>>> from survey.models import Interview
+>>> surveys[0].allows_multiple_interviews = False
+>>> found = check_interviews(surveys[0])
+>>> len(found['duplicate']), found['partial']
+(1, [])
+>>> first = surveys[0].interviews.order_by('id')[0]
+>>> again = Interview.objects.create(survey=surveys[0], uuid='again',
+...                                  session_key=first.session_key)
+>>> found = check_interviews(surveys[0])
+>>> len(found['duplicate']), 'again' in found['duplicate'], found['partial']
+(2, True, [u'again'])
+
+The doctests share the database, remove the surveys
+
+>>> for survey in surveys:
+...     survey.delete()
+>>> User.objects.get(username='bench_test').delete()
+"""
@@ -0,0 +1,89 @@
+test_cases = r"""
+Test the metrics registry and its exposition
+
+>>> from survey.metrics import Registry
+>>> registry = Registry()
+>>> hits = registry.counter('test_hits_total', 'Hits.', ('page',))
+>>> latency = registry.histogram('test_seconds', 'Latency.', ('page',),
+...                              buckets=(0.1, 1))
+>>> hits.inc(page='a'); hits.inc(2, page='a'); hits.inc(page='b"')
+>>> latency.observe(0.05, page='a'); latency.observe(0.5, page='a')
+>>> latency.observe(3, page='a')
+>>> print registry.exposition(),
+# HELP test_hits_total Hits.
+# TYPE test_hits_total counter
+test_hits_total{page="a"} 3
+test_hits_total{page="b\""} 1
+# HELP test_seconds Latency.
+# TYPE test_seconds histogram
+test_seconds_bucket{page="a",le="0.1"} 1
+test_seconds_bucket{page="a",le="1"} 2
+test_seconds_bucket{page="a",le="+Inf"} 3
+test_seconds_sum{page="a"} 3.55
+test_seconds_count{page="a"} 3
+>>> hits.inc(pages='a')
+Traceback (most recent call last):
+...
+ValueError: test_hits_total takes the labels page
+
+The survey views feed the metrics of the survey app
+
+>>> from django.conf import settings
+>>> from django.contrib.auth.models import User
+>>> from django.test.client import Client
+>>> from survey import metrics
+>>> from survey.bench import generate, _post_data
+>>> metrics.REGISTRY.reset()
+>>> survey, = generate(surveys=1, questions=5, interviews=1,
+...                    username='user_metrics')
+>>> c = Client()
+>>> c.post("/survey/detail/bench-0/", _post_data(survey)).status_code
+302
+>>> c.post("/survey/detail/bench-0/", {}).status_code
+200
+>>> c.post("/survey/detail/bench-0/", {'%d_%d-answer' % (survey.id,
+...     survey.questions.all()[0].id): 'Only one'}).status_code
+200
+>>> metrics.submissions.value(survey='bench-0', outcome='saved')
+1
+>>> metrics.answers_written.value(survey='bench-0')
+6
+>>> metrics.validation_failures.value(survey='bench-0')
+1
+>>> for i in range(3):
+...     c.get("/survey/answers/bench-0/").status_code
+200
+200
+200
+>>> (metrics.results_cache.value(result='hit'),
+...  metrics.results_cache.value(result='miss'))
+(2, 1)
+>>> metrics.view_seconds.count(view='survey_detail')
+3
+>>> metrics.view_seconds.count(view='answers_list')
+3
+
+The metrics are served to the internal IPs and to the staff
+
+>>> internal_ips, settings.INTERNAL_IPS = settings.INTERNAL_IPS, ()
+>>> c.get("/survey/metrics/").status_code
+403
+>>> settings.INTERNAL_IPS = ('127.0.0.1',)
+>>> response = c.get("/survey/metrics/")
+>>> response.status_code, response['Content-Type']
+(200, 'text/plain; version=0.0.4; charset=utf-8')
+>>> 'survey_submissions_total{outcome="saved",survey="bench-0"} 1' in response.content
+True
+>>> settings.INTERNAL_IPS = ()
+>>> c.login(username='user_metrics', password='user_metrics')
+True
+>>> c.get("/survey/metrics/").status_code
+200
+>>> settings.INTERNAL_IPS = internal_ips
+
+The doctests share the database, remove the survey
+
+>>> survey.delete()
+>>> User.objects.get(username='user_metrics').delete()
+>>> metrics.REGISTRY.reset()
+"""
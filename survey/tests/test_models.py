@@ -29,6 +29,18 @@ False
 >>> survey.open
 True
 
+The open state is cached until the survey opens or closes
+
+>>> from survey.models import _open_state, open_states
+>>> _open_state(survey, datetime.datetime(2008,03,01,11,11,1))
+(False, 10)
+>>> _open_state(survey, datetime.datetime(2099,03,01,11,11,9,500))
+(True, 2)
+>>> _open_state(survey, datetime.datetime(2099,03,01,11,11,12))
+(False, None)
+>>> open_states([survey, survey])
+[True, True]
+
 >>> survey.answer_count
 0
 >>> survey.interview_count
@@ -67,4 +79,227 @@ Test the creation of a choice
 >>> question1.choices.all()
 [<Choice: Yes>, <Choice: No>]
 
+Test the results engine
+
+>>> question1.qtype = 'R'
+>>> question1.save()
+>>> for uuid, text in (('1', 'Yes'), ('2', 'Yes'), ('3', 'No')):
+...     Answer(question=question1, session_key='abc', interview_uuid=uuid,
+...            text=text).save()
+>>> Answer(question=question2, session_key='abc', interview_uuid='1',
+...        text='Fine').save()
+
+Answers saved outside of the answer forms are not tallied until they are
+linked to their choice and the tallies are rebuilt
+
+>>> choice1.count
+0
+>>> Answer.objects.link_choices(survey)
+3
+>>> Answer.objects.link_choices(survey)
+0
+>>> ChoiceTally.objects.rebuild(survey)
+
+nor are their interviews recorded until they are backfilled
+
+>>> survey.interviews.count()
+0
+>>> Interview.objects.backfill()
+3
+>>> Interview.objects.backfill()
+0
+>>> [(i.uuid, i.answers.count()) for i in survey.interviews.order_by('uuid')]
+[(u'1', 2), (u'2', 1), (u'3', 1)]
+>>> results = survey.results()
+>>> [(q.text, q.answer_count) for q in results]
+[(u'Is it working ?', 3), (u'How are you doing ?', 1)]
+>>> [(c.text, c.count) for c in results[0].choice_list]
+[(u'Yes', 2), (u'No', 1)]
+>>> [a.text for a in results[1].answer_list]
+[u'Fine']
+>>> survey.interview_count
+3
+
+Test the export, one row per interview
+
+>>> from survey.export import interviews, export_csv, export_jsonl
+>>> [(i['interview_uuid'], sorted(i['answers'].values()))
+...  for i in interviews(survey, chunk_size=1)]
+[(u'1', [[u'Fine'], [u'Yes']]), (u'2', [[u'Yes']]), (u'3', [[u'No']])]
+>>> lines = list(export_csv(survey, chunk_size=2))
+>>> lines[0]
+'interview_uuid,session_key,user,submission_date,Is it working ?,How are you doing ?\r\n'
+>>> lines[1].startswith('1,abc,,') and lines[1].endswith(',Yes,Fine\r\n')
+True
+>>> len(list(export_jsonl(survey)))
+3
+
+Test the pages of free text answers
+
+>>> for text in ('Good', 'Bad'):
+...     Answer(question=question2, session_key='abc', interview_uuid='4',
+...            text=text).save()
+>>> [a.text for a in question2.answer_page(size=2)]
+[u'Fine', u'Good']
+>>> question2.next_start
+2
+>>> [a.text for a in question2.answer_page(question2.next_cursor, 2, size=2)]
+[u'Bad']
+>>> print question2.next_cursor
+None
+
+The first pages of several questions are loaded with one query
+
+>>> pages = Answer.objects.first_pages([question1.id, question2.id], 2)
+>>> [a.text for a in pages[question1.id]]
+[u'Yes', u'Yes']
+>>> [a.text for a in pages[question2.id]]
+[u'Fine', u'Good']
+>>> Answer.objects.first_pages([], 2)
+{}
+
+Test the results cache
+
+>>> survey.cached_results()[0].answer_count
+3
+>>> survey.cached_results()[1].answer_count
+3
+>>> version = results_version(survey.id)
+>>> Answer(question=question2, session_key='abc', interview_uuid='5',
+...        text='Great').save()
+>>> results_version(survey.id) == version
+False
+>>> survey.cached_results()[1].answer_count
+4
+
+Updates bypassing the signals are not seen until the version changes
+
+>>> Answer.objects.filter(text='Great').update(text='Greater')
+1
+>>> [a.text for a in survey.cached_results()[1].answer_list][-1]
+u'Great'
+>>> bump_results_version(survey.id)
+>>> [a.text for a in survey.cached_results()[1].answer_list][-1]
+u'Greater'
+
+Test the statistics of the survey lists
+
+>>> Interview.objects.backfill()
+2
+>>> class Session(object):
+...     session_key = 'ABC'
+>>> class Request(object):
+...     session = Session()
+>>> surveys = list(Survey.objects.filter(visible=True)
+...                .with_stats(Request()))
+>>> [(s.slug, s.open, s.interview_count, s.has_answers_from('abc'))
+...  for s in surveys]
+[(u'survey-1', True, 5, True)]
+>>> surveys[0].has_answers_from('def')
+False
+
+Test the compiled schema
+
+>>> from survey.schema import get_schema
+>>> schema = get_schema(survey)
+>>> get_schema(survey) is schema
+True
+>>> [(c.question.text, [text for key, text, url in c.choices]) for c in schema]
+[(u'Is it working ?', [u'Yes', u'No']), (u'How are you doing ?', [])]
+>>> choice2.text = 'Nope'
+>>> choice2.save()
+>>> get_schema(survey) is schema
+False
+>>> sorted(get_schema(survey)[0].choices_dict.values())
+[u'Nope', u'Yes']
+
+Renaming a choice keeps its votes
+
+>>> ChoiceTally.objects.rebuild(survey)
+>>> Choice.objects.get(id=choice2.id).count
+1
+
+Test the submission spool, a submission is inserted once however many times
+it is spooled or drained
+
+>>> import os, tempfile
+>>> from django.contrib.auth.models import AnonymousUser
+>>> from survey import spool
+>>> from survey.forms import TextInputAnswer
+>>> path = tempfile.mktemp()
+>>> form = TextInputAnswer(question2, AnonymousUser(), 'spooled', 'abc',
+...                        data={'answer': 'Spooled'})
+>>> form.is_valid()
+True
+>>> spool.spool_answers([form], path)
+>>> spool.spool_answers([form], path)
+>>> spool.stats(path)['pending']
+1
+>>> Answer.objects.filter(interview_uuid='spooled').count()
+0
+>>> spool.drain(path=path)
+1
+>>> spool.spool_answers([form], path)
+>>> spool.drain(path=path)
+1
+>>> spool.stats(path) == {'pending': 0, 'lag': 0.0}
+True
+>>> Answer.objects.filter(interview_uuid='spooled').count()
+1
+>>> os.remove(path)
+
+Deleting choices in bulk, as the admin action does, keeps their answers. The
+tallies are not rebuilt while answers remain to be linked to their choice
+
+>>> from survey.management.commands.rebuild_tallies import Command
+>>> choice3 = Choice(question=question1, text='Maybe')
+>>> choice3.save()
+>>> Answer(question=question1, session_key='abc', interview_uuid='6',
+...        text='Maybe').save()
+>>> Answer.objects.unlinked(survey).count()
+1
+>>> Command().handle('survey-1', verbosity=0)
+Traceback (most recent call last):
+...
+CommandError: Some answers of survey-1 do not reference their choice yet and would not be counted, run link_answer_choices instead.
+>>> Answer.objects.link_choices(survey)
+1
+>>> Choice.objects.filter(id=choice3.id).delete()
+>>> Answer.objects.filter(interview_uuid='6').values_list('text', 'choice')
+[(u'Maybe', None)]
+>>> Answer.objects.unlinked(survey).count()
+0
+>>> Command().handle('survey-1', verbosity=0)
+>>> Answer.objects.filter(interview_uuid='6').delete()
+
+Deleting answers, directly or with their interview as the admin does, takes
+them out of the tallies
+
+>>> [Choice.objects.get(id=c.id).count for c in (choice1, choice2)]
+[2, 1]
+>>> Answer.objects.filter(question=question1, interview_uuid='2').delete()
+>>> Interview.objects.filter(uuid='3').delete()
+>>> [Choice.objects.get(id=c.id).count for c in (choice1, choice2)]
+[1, 0]
+>>> [(c.text, c.count) for c in survey.results()[0].choice_list]
+[(u'Yes', 1), (u'Nope', 0)]
+
+The backfill claims the surveys accepting a single interview for the
+respondents who answered before, on their first interview
+
+>>> Survey.objects.filter(id=survey.id).update(allows_multiple_interviews=False)
+1
+>>> Interview.objects.backfill()
+0
+>>> survey.interviews.exclude(claim=None).values_list('uuid', 'claim')
+[(u'1', u'abc')]
+
+The answers table of the test database needs no upgrade
+
+>>> from survey.management.commands.upgrade_survey_schema import \
+...     upgrade_statements
+>>> upgrade_statements()
+[]
+
 """
+
@@ -0,0 +1,165 @@
+from __future__ import with_statement
+
+from django.core.urlresolvers import reverse
+
+from survey.instrumentation import QueryRecorder
+
+
+# The most queries each page of survey/urls.py may run, whatever the number
+# of questions of the survey.
+QUERY_BUDGETS = {
+    'GET surveys-visible': 5,
+    'GET surveys-editable': 5,
+    'GET survey-detail': 7,
+    'POST survey-detail': 5,
+    'GET survey-results': 11,
+    'GET answers-detail': 4,
+    'GET answers-export': 8,
+    'GET answers-more': 6,
+    'GET survey-results-json': 11,
+    'GET survey-edit': 5,
+    'GET survey-add': 2,
+    'GET survey-update': 3,
+    'GET survey-delete': 3,
+    'GET question-add': 3,
+    'GET question-update': 5,
+    'GET question-delete': 4,
+    'GET choice-add': 3,
+    'GET choice-update': 5,
+    'GET choice-delete': 3,
+    'GET delete-image': 3,
+    'GET survey-metrics': 2,
+}
+
+
+def pages(survey):
+    """
+    Return the name, method, URL and data of a request to every page of
+    survey/urls.py about a generated survey.
+    """
+    question = survey.questions.filter(qtype='C')[0]
+    choice = question.choices.all()[0]
+    key = survey.interviews.values_list('session_key', flat=True)[0]
+    slug = {'survey_slug': survey.slug}
+    answer = {'%d_%d-answer' % (survey.id, question.id): [choice.id]}
+    return [
+        ('surveys-visible', 'get', reverse('surveys-visible'), None),
+        ('surveys-editable', 'get', reverse('surveys-editable'), None),
+        ('survey-detail', 'get', reverse('survey-detail', kwargs=slug), None),
+        ('survey-detail', 'post', reverse('survey-detail', kwargs=slug),
+         answer),
+        ('survey-results', 'get', reverse('survey-results', kwargs=slug),
+         None),
+        ('answers-detail', 'get', reverse('answers-detail',
+            kwargs=dict(slug, key=key)), None),
+        ('answers-export', 'get', reverse('answers-export',
+            kwargs=dict(slug, format='csv')), None),
+        ('answers-more', 'get', reverse('answers-more',
+            kwargs=dict(slug, question_id=question.id)), None),
+        ('survey-results-json', 'get', reverse('survey-results-json',
+                                               kwargs=slug), None),
+        ('survey-edit', 'get', reverse('survey-edit', kwargs=slug), None),
+        ('survey-add', 'get', reverse('survey-add'), None),
+        ('survey-update', 'get', reverse('survey-update', kwargs=slug), None),
+        ('survey-delete', 'get', reverse('survey-delete', kwargs=slug), None),
+        ('question-add', 'get', reverse('question-add', kwargs=slug), None),
+        ('question-update', 'get', reverse('question-update',
+            kwargs=dict(slug, question_id=question.id)), None),
+        ('question-delete', 'get', reverse('question-delete',
+            kwargs=dict(slug, question_id=question.id)), None),
+        ('choice-add', 'get', reverse('choice-add',
+            kwargs={'question_id': question.id}), None),
+        ('choice-update', 'get', reverse('choice-update',
+            kwargs={'question_id': question.id, 'choice_id': choice.id}),
+         None),
+        ('choice-delete', 'get', reverse('choice-delete',
+            kwargs=dict(slug, choice_id=choice.id)), None),
+        ('delete-image', 'get', reverse('delete-image',
+            kwargs={'model_string': 'choice', 'object_id': choice.id}), None),
+        ('survey-metrics', 'get', reverse('survey-metrics'), None),
+    ]
+
+def count_queries(client, survey):
+    """
+    Request every page about a survey and return the number of queries of
+    each, keyed by the page name and method.
+    """
+    counts = {}
+    for name, method, url, data in pages(survey):
+        with QueryRecorder() as recorder:
+            if data is None:
+                response = getattr(client, method)(url)
+            else:
+                response = getattr(client, method)(url, data)
+            # The exports are written while the content is read.
+            response.content
+        if response.status_code not in (200, 302):
+            raise AssertionError('%s returned %d' % (url,
+                                                     response.status_code))
+        counts['%s %s' % (method.upper(), name)] = recorder.count
+    return counts
+
+def over_budget(counts):
+    "Return the pages of ``counts`` running more queries than their budget."
+    return sorted('%s: %d > %d' % (page, count, QUERY_BUDGETS[page])
+                  for page, count in counts.items()
+                  if count > QUERY_BUDGETS[page])
+
+test_cases = r"""
+The query recorder counts the statements whatever the DEBUG setting, and
+reports the ones run more than once
+
+>>> from survey.instrumentation import QueryRecorder
+>>> from survey.models import Survey, Question
+>>> with QueryRecorder() as recorder:
+...     for slug in ('a', 'b', 'c'):
+...         Survey.objects.filter(slug=slug).count()
+...     with QueryRecorder() as inner:
+...         Question.objects.filter(text='d').count()
+0
+0
+0
+0
+>>> recorder.count, inner.count
+(4, 1)
+>>> recorder.time >= 0
+True
+>>> [count for count, sql in recorder.duplicates]
+[3]
+
+Every page of survey/urls.py keeps to its query budget, on a survey of 5
+answered questions and on one of 20, of every type
+
+>>> from django.test.client import Client
+>>> from survey.bench import generate
+>>> from django.contrib.auth.models import User
+>>> from survey.tests.test_query_budgets import QUERY_BUDGETS,\
+...     count_queries, over_budget
+>>> small, = generate(surveys=1, questions=5, interviews=3,
+...                   username='user_budgets', prefix='budgets-small')
+>>> large, = generate(surveys=1, questions=20, interviews=3,
+...                   username='user_budgets', prefix='budgets-large')
+>>> client = Client()
+>>> client.login(username='user_budgets', password='user_budgets')
+True
+>>> small_counts = count_queries(client, small)
+>>> sorted(small_counts) == sorted(QUERY_BUDGETS)
+True
+>>> over_budget(small_counts)
+[]
+>>> large_counts = count_queries(client, large)
+>>> over_budget(large_counts)
+[]
+
+The number of queries does not grow with the number of questions
+
+>>> sorted(page for page in small_counts
+...        if large_counts[page] > small_counts[page])
+[]
+
+The doctests share the database, remove the surveys
+
+>>> small.delete()
+>>> large.delete()
+>>> User.objects.get(username='user_budgets').delete()
+"""
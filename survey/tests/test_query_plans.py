@@ -0,0 +1,131 @@
+import re
+
+from django.db import connections
+
+from survey.models import Answer, Interview
+
+
+def query_plan(queryset):
+    "Return the steps of the SQLite query plan of a queryset."
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    cursor = connections[queryset.db].cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    return [row[-1] for row in cursor.fetchall()]
+
+def scanned_tables(queryset):
+    """
+    Return the tables read from end to end by a queryset, including the
+    tables read through the whole of one of their indexes.
+    """
+    return sorted(set(match.group(2) for match in
+                      [re.match(r'SCAN (TABLE )?(\w+)', step)
+                       for step in query_plan(queryset)] if match))
+
+def seed(survey, questions, interviews=1000):
+    """
+    Answer every question of ``questions`` once per interview, the choice
+    questions with their choices in turn.
+    """
+    choices = dict((question.id, list(question.choices.all()))
+                   for question in questions)
+    answers = []
+    for i in range(interviews):
+        interview = Interview.objects.create(survey=survey, uuid='uuid%d' % i,
+                                             session_key='key%d' % i)
+        for question in questions:
+            answer = Answer(question=question, session_key=interview.uuid,
+                            interview_uuid=interview.uuid, interview=interview,
+                            text='answer %d' % i)
+            if choices[question.id]:
+                answer.choice = choices[question.id][i % 3]
+                answer.text = answer.choice.text
+            answers.append(answer)
+    Answer.objects.insert_many(answers)
+    connections[Answer.objects.db].cursor().execute('ANALYZE')
+
+
+test_cases = r"""
+Test that the hot queries on the answers and the interviews use an index
+
+>>> from survey.models import *
+>>> from survey.forms import existing_answers
+>>> from survey.tests.test_query_plans import scanned_tables, seed
+>>> from django.contrib.auth.models import User
+>>> import datetime
+
+>>> user = User.objects.create_user('user_plans', 'user@test.fr', 'password')
+>>> survey = Survey(title="survey plans", slug="survey-plans",
+...     opens=datetime.datetime(2008,03,01,11,11,11),
+...     closes=datetime.datetime(2099,03,01,11,11,11),
+...     created_by=user, editable_by=user)
+>>> survey.save()
+>>> text = Question.objects.create(survey=survey, qtype='T', text="Why ?")
+>>> radio = Question.objects.create(survey=survey, qtype='R', text="Which ?")
+>>> for name in ('a', 'b', 'c'):
+...     Choice(question=radio, text=name).save()
+>>> seed(survey, [text, radio])
+>>> Answer.objects.filter(question__survey=survey.id).count()
+2000
+
+The answer texts are not indexed
+
+>>> scanned_tables(Answer.objects.filter(text='answer 10'))
+[u'survey_answer']
+
+The answers of a respondent, for editing them
+
+>>> scanned_tables(Answer.objects.filter(question__survey=survey.id,
+...                                      session_key='key10').order_by('-id'))
+[]
+>>> scanned_tables(Answer.objects.filter(question__survey=survey.id,
+...                                      user=user).order_by('-id'))
+[]
+
+The pages of free text answers
+
+>>> scanned_tables(text.answers.order_by('submission_date', 'id')[:20])
+[]
+>>> last = text.answer_page()[-1]
+>>> scanned_tables(text.answers.order_by('submission_date', 'id')
+...     .filter(Q(submission_date__gt=last.submission_date) |
+...             Q(submission_date=last.submission_date, id__gt=last.id))[:20])
+[]
+
+The answers of an interview
+
+>>> scanned_tables(Answer.objects.filter(interview_uuid='uuid10'))
+[]
+>>> scanned_tables(Answer.objects.filter(interview__uuid='uuid10'))
+[]
+
+The answers of a choice
+
+>>> scanned_tables(Answer.objects.filter(question=radio,
+...                                      choice__isnull=False))
+[]
+
+The interviews of a respondent
+
+>>> scanned_tables(Interview.objects.filter(survey=survey.id,
+...                                         session_key='key10'))
+[]
+>>> scanned_tables(Interview.objects.filter(survey=survey.id, user=user))
+[]
+
+The chunks of the export, the interviews after the last one and their
+answers
+
+>>> ids = list(Interview.objects.filter(survey=survey.id, id__gt=10)
+...            .order_by('id').values_list('id', flat=True)[:100])
+>>> scanned_tables(Interview.objects.filter(survey=survey.id, id__gt=10)
+...                .order_by('id')[:100])
+[]
+>>> scanned_tables(Answer.objects.filter(interview__in=ids)
+...                .order_by('interview', 'id'))
+[]
+
+The doctests share the database, remove the survey
+
+>>> survey.delete()
+>>> user.delete()
+"""
@@ -0,0 +1,98 @@
+test_cases = r"""
+Test the JSON results and their deltas since a cursor
+
+>>> from django.contrib.auth.models import User
+>>> from django.test.client import Client
+>>> from django.utils import simplejson
+>>> from survey import models
+>>> from survey.bench import generate, _post_data
+>>> from survey.models import Answer, Interview
+
+>>> settle, models.RESULTS_SETTLE_SECONDS = models.RESULTS_SETTLE_SECONDS, 0
+>>> survey, = generate(surveys=1, questions=5, interviews=2,
+...                    username='user_results_api')
+>>> c = Client()
+>>> def results(since=None):
+...     response = c.get("/survey/answers/bench-0/json/",
+...                      since and {'since': since} or {})
+...     return simplejson.loads(response.content)
+
+Without a cursor every count is given, with the texts
+
+>>> full = results()
+>>> full['full'], full['interview_count'], len(full['questions'])
+(True, 2, 5)
+>>> question = full['questions'][2]
+>>> question['text'], question['qtype'], question['answer_count']
+(u'Question 2', u'S', 2)
+>>> sum(choice['count'] for choice in question['choices'])
+2
+>>> sorted(question['choices'][0])
+[u'count', u'id', u'text']
+
+With the cursor only the answers and interviews added since are counted
+
+>>> delta = results(full['cursor'])
+>>> delta['full'], delta['interview_count'], delta['questions']
+(False, 0, [])
+>>> delta['cursor'] == full['cursor']
+True
+>>> c.post("/survey/detail/bench-0/", _post_data(survey)).status_code
+302
+>>> delta = results(full['cursor'])
+>>> delta['full'], delta['interview_count'], len(delta['questions'])
+(False, 1, 5)
+>>> [q['answer_count'] for q in delta['questions']]
+[1, 1, 1, 1, 2]
+>>> delta['questions'][2]['choices']
+[{u'count': 1, u'id': ...}]
+>>> results(delta['cursor'])['questions']
+[]
+
+The answers too recent to be committed in order are left to the next call
+
+>>> models.RESULTS_SETTLE_SECONDS = 60
+>>> c.post("/survey/detail/bench-0/", _post_data(survey)).status_code
+302
+>>> results(delta['cursor'])['cursor'] == delta['cursor']
+True
+
+and so are they from the counts given in full, taken out of the tallies.
+Every answer of the test is that recent
+
+>>> recent = results()
+>>> recent['full'], recent['interview_count']
+(True, 0)
+>>> [q['answer_count'] for q in recent['questions']]
+[0, 0, 0, 0, 0]
+>>> sum(choice['count'] for choice in recent['questions'][2]['choices'])
+0
+>>> models.RESULTS_SETTLE_SECONDS = 0
+>>> since = results(recent['cursor'])
+>>> since['full'], since['interview_count'], since['questions'][0]['answer_count']
+(False, 4, 4)
+>>> sum(choice['count'] for choice in since['questions'][2]['choices'])
+4
+>>> delta = results(delta['cursor'])
+>>> delta['interview_count'], delta['questions'][0]['answer_count']
+(1, 1)
+
+Changing or deleting answers gives every count again
+
+>>> Answer.objects.filter(question__survey=survey).order_by('id')[0].delete()
+>>> full = results(delta['cursor'])
+>>> full['full'], full['interview_count'], full['questions'][0]['answer_count']
+(True, 4, 3)
+>>> Interview.objects.filter(survey=survey).order_by('-id')[0].delete()
+>>> full = results(full['cursor'])
+>>> full['full'], full['interview_count']
+(True, 3)
+>>> results('garbage')['full']
+True
+
+The doctests share the database, remove the survey
+
+>>> models.RESULTS_SETTLE_SECONDS = settle
+>>> survey.delete()
+>>> User.objects.get(username='user_results_api').delete()
+"""
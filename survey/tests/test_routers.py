@@ -0,0 +1,103 @@
+test_cases = r"""
+Test the read replica router with a second SQLite database
+
+>>> import os, tempfile
+>>> from django.conf import settings
+>>> from django.core.management import call_command
+>>> from django.db import connections, router
+>>> from django.test.client import Client
+>>> from survey import routers
+>>> from survey.models import *
+>>> from django.contrib.auth.models import User
+>>> import datetime
+
+>>> replica = tempfile.mktemp(suffix='.db')
+>>> connections.databases['replica'] = dict(
+...     connections.databases['default'], NAME=replica, TEST_NAME=replica)
+>>> call_command('syncdb', database='replica', interactive=False,
+...              verbosity=0)
+>>> router.routers.insert(0, routers.SurveyRouter())
+>>> routers.READ_DATABASE = 'replica'
+
+The survey is only written to the default database, the replica lags
+
+>>> user = User.objects.create_user('user_replica', 'user@test.fr', 'password')
+>>> survey = Survey(title="survey replica", slug="survey-replica",
+...     opens=datetime.datetime(2008,03,01,11,11,11),
+...     closes=datetime.datetime(2099,03,01,11,11,11),
+...     visible=True, public=True, created_by=user, editable_by=user)
+>>> survey.save()
+>>> question = Question(survey=survey, qtype='T', text="Replicated ?")
+>>> question.save()
+>>> Survey.objects.filter(slug="survey-replica").count()
+1
+>>> Survey.objects.using('replica').filter(slug="survey-replica").count()
+0
+
+The browsing views read from the replica
+
+>>> c = Client()
+>>> c.get("/survey/visible/").content.find("survey replica") > -1
+False
+
+Until the client submits, then it sticks to the default database
+
+>>> response = c.post("/survey/detail/survey-replica/",
+...                   {"%d_%d-answer" % (survey.id, question.id): "Yes"})
+>>> response.status_code
+302
+>>> routers.STICKY_COOKIE in response.cookies
+True
+>>> c.get("/survey/visible/").content.find("survey replica") > -1
+True
+>>> Answer.objects.using('replica').count()
+0
+
+The objects read from the replica do not take the reads which must see the
+latest answers there
+
+>>> Survey.objects.get(id=survey.id).save_base(using='replica',
+...                                            force_insert=True)
+>>> replicated = Survey.objects.using('replica').get(slug="survey-replica")
+>>> replicated.questions.count()
+1
+>>> bump_results_version(survey.id)
+>>> [(q.text, q.answer_count) for q in replicated.cached_results()]
+[(u'Replicated ?', 1)]
+
+In the views reading from the replica the results are computed there, and
+computed again once the replica caught up with their last change
+
+>>> import time
+>>> from django.core.cache import cache
+>>> from survey.instrumentation import QueryRecorder
+>>> routers._state.replica = 'replica'
+>>> bump_results_version(survey.id)
+>>> with QueryRecorder() as primary:
+...     replicated.cached_results()
+[]
+>>> primary.count
+0
+>>> replicated.cached_results()
+[]
+>>> question.save_base(using='replica', force_insert=True)
+>>> entry = cache.get('survey_%d_results' % survey.id)
+>>> entry['recompute_at'] - time.time() <= routers.STICKY_SECONDS
+True
+>>> entry['recompute_at'] = time.time()
+>>> cache.set('survey_%d_results' % survey.id, entry)
+>>> [q.text for q in replicated.cached_results()]
+[u'Replicated ?']
+>>> routers._state.replica = None
+
+The doctests share the database, remove the survey and the replica
+
+>>> routers.READ_DATABASE = None
+>>> del router.routers[0]
+>>> connections['replica'].close()
+>>> del connections._connections['replica']
+>>> del connections.databases['replica']
+>>> os.remove(replica)
+>>> survey.delete()
+>>> user.delete()
+"""
@@ -0,0 +1,57 @@
+test_cases = r"""
+Test the timing of the survey views and the sampling profiler
+
+>>> import os, pstats, shutil, tempfile
+>>> from django.test.client import Client
+>>> from django.contrib.auth.models import User
+>>> from survey import instrumentation
+>>> from survey.bench import generate
+
+>>> survey, = generate(surveys=1, questions=5, interviews=1,
+...                    username='user_timings')
+>>> timed = []
+>>> def receiver(sender, request, survey_slug, timings, **kwargs):
+...     timed.append((sender.__name__, survey_slug, sorted(timings)))
+>>> instrumentation.view_timed.connect(receiver)
+
+The views send the time spent in the database and in each phase
+
+>>> c = Client()
+>>> c.get("/survey/detail/bench-0/").status_code
+200
+>>> timed[-1]
+('survey_detail', u'bench-0', ['forms_ms', 'other_ms', 'render_ms', 'sql_ms', 'total_ms'])
+>>> c.login(username='user_timings', password='user_timings')
+True
+>>> c.get("/survey/answers/bench-0/").status_code
+200
+>>> timed[-1]
+('answers_list', u'bench-0', ['other_ms', 'render_ms', 'results_ms', 'sql_ms', 'total_ms'])
+
+One request in PROFILE_EVERY is profiled
+
+>>> instrumentation.PROFILE_DIR = tempfile.mkdtemp()
+>>> instrumentation.PROFILE_EVERY = 2
+>>> for i in range(4):
+...     c.get("/survey/answers/bench-0/").status_code
+200
+200
+200
+200
+>>> profiles = sorted(os.listdir(instrumentation.PROFILE_DIR))
+>>> len(profiles)
+2
+>>> profiles[0].startswith('answers_list.bench-0.')
+True
+>>> pstats.Stats(os.path.join(instrumentation.PROFILE_DIR,
+...                           profiles[0])).total_calls > 0
+True
+
+The doctests share the database, remove the survey
+
+>>> shutil.rmtree(instrumentation.PROFILE_DIR)
+>>> instrumentation.PROFILE_DIR = None
+>>> instrumentation.view_timed.disconnect(receiver)
+>>> survey.delete()
+>>> User.objects.get(username='user_timings').delete()
+"""
@@ -73,11 +73,13 @@ TODO: Remove the magic number 3, it comes from the question_id previously added
 >>> response.status_code
 302
 
-Add an interview ::
+Add an interview, the blank forms are rendered once for every visitor ::
 
 >>> response = c.get("/survey/detail/test-survey-update/")
 >>> response.status_code
 200
+>>> response.context['survey'].forms_html.find('name="2_3-answer"') > -1
+True
 >>> response = c.post("/survey/detail/test-survey-update/",
 ... {"2_3-answer":4})
 >>> response.status_code
@@ -119,6 +121,179 @@ Update a choice::
 >>> response.content.find("may be") > -1
 True
 
+Add a free text question and answer it::
+
+>>> response =  c.post("/survey/question/add/test-survey-update/",
+... {"qtype":"T","text" : "test question text input"})
+>>> response.status_code
+302
+>>> response = c.post("/survey/detail/test-survey-update/",
+... {"2_3-answer":3, "2_4-answer":"free text answer"})
+>>> response.status_code
+302
+>>> response = c.get("/survey/answers/test-survey-update/")
+>>> response.content.find("free text answer") > -1
+True
+>>> response = c.get("/survey/answers/test-survey-update/question/4/")
+>>> response.content.find("free text answer") > -1
+True
+
+Add a checkbox question, the answers of an interview are saved together::
+
+>>> response =  c.post("/survey/question/add/test-survey-update/",
+... {"qtype":"C","text" : "test question checkbox list"})
+>>> response =  c.post("/survey/choice/add/5/", {"text" : "red"})
+>>> response =  c.post("/survey/choice/add/5/", {"text" : "blue"})
+>>> response = c.post("/survey/detail/test-survey-update/",
+... {"2_3-answer":3, "2_4-answer":"colors", "2_5-answer":[5, 6]})
+>>> response.status_code
+302
+>>> from survey.models import Answer, Choice, Interview
+>>> answers = Answer.objects.filter(question__survey__slug="test-survey-update",
+...                                 question__qtype="C")
+>>> sorted((a.text, a.user.username) for a in answers)
+[(u'blue', u'test_urls'), (u'red', u'test_urls')]
+>>> len(set(a.interview_uuid for a in answers))
+1
+>>> answers[0].interview_uuid == Answer.objects.get(text="colors").interview_uuid
+True
+>>> answers[0].interview.uuid == answers[0].interview_uuid
+True
+>>> answers[0].interview.answers.count()
+4
+>>> sorted(a.choice_id for a in answers)
+[5, 6]
+>>> [choice.count for choice in Choice.objects.filter(question=5)]
+[1, 1]
+
+Edit the last interview, its answers are looked up once and edited in place::
+
+>>> from django.http import QueryDict
+>>> from survey.forms import forms_for_survey, save_answers
+>>> from survey.models import Survey
+>>> class Session(object):
+...     session_key = 'ABC'
+>>> class Request(object):
+...     session = Session()
+...     user = User.objects.get(username="test_urls")
+...     POST = QueryDict('')
+>>> survey = Survey.objects.get(slug="test-survey-update")
+>>> forms = forms_for_survey(survey, Request(), edit_existing=True)
+>>> [form.initial['answer'] for form in forms]
+['3', u'colors', ['5', '6']]
+
+The forms are rendered in a single pass, to the same HTML as per question ::
+
+>>> from survey.bench import bench_render_forms
+>>> sorted(bench_render_forms(forms, repeat=1))
+['per_question', 'single_pass']
+
+>>> len(set(form.interview_uuid for form in forms))
+1
+>>> forms[0].interview_uuid == answers[0].interview_uuid
+True
+>>> Request.POST = QueryDict('2_3-answer=4&2_4-answer=colors&2_5-answer=5')
+>>> forms = forms_for_survey(survey, Request(), edit_existing=True)
+>>> all(form.is_valid() for form in forms)
+True
+>>> save_answers(forms)
+3
+>>> [a.text for a in Answer.objects.filter(question=5)]
+[u'red']
+>>> [a.text for a in answers[0].interview.answers.filter(question=5)]
+[u'red']
+>>> [choice.count for choice in Choice.objects.filter(question=5)]
+[1, 0]
+>>> [choice.count for choice in Choice.objects.filter(question=3)]
+[2, 3]
+
+Editing the answers from another session of the user moves the interview to
+that session ::
+
+>>> second = Client()
+>>> second.login(username="test_urls", password="test_urls")
+True
+>>> key = second.session.session_key
+>>> class SecondRequest(Request):
+...     session = second.session
+>>> forms = forms_for_survey(survey, SecondRequest(), edit_existing=True)
+>>> all(form.is_valid() for form in forms)
+True
+>>> save_answers(forms)
+3
+>>> Interview.objects.get(uuid=answers[0].interview_uuid).session_key == key
+True
+>>> second.get("/survey/answers/test-survey-update/%s/" % key).status_code
+200
+
+A survey accepting a single interview is claimed by its respondent, on
+their first interview when they answered before ::
+
+>>> interviews = Interview.objects.filter(survey=survey.id)
+>>> interviews.filter(claim__isnull=False).count()
+0
+>>> survey.allows_multiple_interviews = False
+>>> survey.save()
+>>> [i.claim for i in interviews.filter(claim__isnull=False)] == ['user:%d' % user.id]
+True
+>>> count = interviews.count()
+>>> for text in ('first', 'second'):
+...     response = c.post("/survey/detail/test-survey-update/",
+...                       {"2_3-answer":3, "2_4-answer":text})
+>>> response.status_code
+302
+>>> interviews.count() - count
+0
+>>> [a.text for a in Answer.objects.filter(text__in=('first', 'second'))]
+[]
+>>> Request.POST = QueryDict('2_3-answer=3')
+
+The claim of a user holds from another session ::
+
+>>> forms = forms_for_survey(survey, Request())
+>>> all(form.is_valid() for form in forms)
+True
+>>> save_answers(forms, single=True)
+Traceback (most recent call last):
+...
+InterviewClaimed: ...
+
+Other integrity errors are not taken for a claim ::
+
+>>> Interview.objects.record(survey.id, Answer(interview_uuid='no-key',
+...                          session_key=None), single=True)
+Traceback (most recent call last):
+...
+IntegrityError: ...
+
+Keep the respondents in a signed cookie, browsing writes no session ::
+
+>>> from survey import respondents
+>>> from django.contrib.sessions.models import Session
+>>> respondents.COOKIE_NAME = 'survey_respondent'
+>>> anonymous = Client()
+>>> sessions = Session.objects.count()
+>>> response = anonymous.get("/survey/detail/test-survey-update/")
+>>> response.status_code, 'survey_respondent' in response.cookies
+(200, False)
+>>> Session.objects.count() == sessions
+True
+>>> response = anonymous.post("/survey/detail/test-survey-update/",
+... {"2_3-answer":3, "2_4-answer":"from a cookie"})
+>>> response.status_code
+302
+>>> token = response.cookies['survey_respondent'].value
+>>> key, answered = respondents.unsign(token)
+>>> answered == set([survey.id])
+True
+>>> Answer.objects.get(text="from a cookie").session_key == key
+True
+>>> respondents.unsign('0' + token) is None
+True
+>>> response = anonymous.get("/survey/visible/")
+>>> "/survey/answers/test-survey-update/%s/" % key in response.content
+True
+>>> respondents.COOKIE_NAME = None
 
 Delete a survey ::
 >>> response =  c.post("/survey/delete/test-survey-update/")
@@ -7,12 +7,12 @@ from django.conf.urls.defaults import *
 from models import Survey
 
 
-from views import answers_list, answers_detail,\
-                survey_detail, survey_edit, survey_add,\
+from views import answers_list, answers_detail, answers_export, answers_more,\
+                results_json, survey_detail, survey_edit, survey_add,\
                 editable_survey_list, survey_delete, survey_update,\
                 question_add, question_update,question_delete,\
                 choice_add, choice_update, choice_delete, delete_image,\
-                visible_survey_list
+                visible_survey_list, metrics_view
 
 
 urlpatterns = patterns('',
@@ -26,6 +26,12 @@ urlpatterns = patterns('',
         answers_list,    name='survey-results'),
     url(r'^answers/(?P<survey_slug>[-\w]+)/(?P<key>[a-fA-F0-9]{10,40})/$',
         answers_detail,  name='answers-detail'),
+    url(r'^answers/(?P<survey_slug>[-\w]+)/export/(?P<format>csv|jsonl)/$',
+        answers_export,  name='answers-export'),
+    url(r'^answers/(?P<survey_slug>[-\w]+)/question/(?P<question_id>\d+)/$',
+        answers_more,    name='answers-more'),
+    url(r'^answers/(?P<survey_slug>[-\w]+)/json/$',
+        results_json,    name='survey-results-json'),
 
     url(r'^edit/(?P<survey_slug>[-\w]+)/$', survey_edit,   name='survey-edit'),
     url(r'^add/$', survey_add,   name='survey-add'),
@@ -41,4 +47,6 @@ urlpatterns = patterns('',
     url(r'^choice/delete/(?P<survey_slug>[-\w]+)/(?P<choice_id>\d+)/$', choice_delete,   name='choice-delete'),
 
     url(r'^delete_image/(?P<model_string>[-\w]+)/(?P<object_id>\d+)/$', delete_image, name='delete-image'),
+
+    url(r'^metrics/$', metrics_view, name='survey-metrics'),
     )
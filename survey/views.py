@@ -1,3 +1,5 @@
+from __future__ import with_statement
+
 from datetime import datetime
 import os
 
@@ -13,12 +15,20 @@ from django.http import HttpResponseNotFound
 from django.template import loader, RequestContext
 from django.template.defaultfilters import slugify
 from django.shortcuts import get_object_or_404, render_to_response
+from django.utils import simplejson
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic.list_detail import object_list
 from django.views.generic.create_update import delete_object
 
-from survey.forms import forms_for_survey, SurveyForm, QuestionForm, ChoiceForm
-from survey.models import Survey, Answer, Question, Choice
+from survey import metrics, spool
+from survey.instrumentation import phase, timed_view
+from survey.respondents import cookie_enabled, get_respondent, set_cookie
+from survey.routers import reads_from_replica, stick_to_primary
+from survey.export import EXPORT_FORMATS
+from survey.forms import blank_forms_html, forms_for_survey, save_answers,\
+                         SurveyForm, QuestionForm, ChoiceForm
+from survey.models import Survey, Answer, Question, Choice, Interview,\
+                          InterviewClaimed
 
 
 def _survey_redirect(request, survey,
@@ -50,20 +60,19 @@ def _survey_redirect(request, survey,
                                                 {'survey_slug': survey.slug}))
 
     # For this survey, have they answered any questions?
-    if (hasattr(request, 'session') and Answer.objects.filter(
-            session_key=request.session.session_key.lower(),
-            question__survey__visible=True,
-            question__survey__slug=survey.slug).count()):
+    key = get_respondent(request).key
+    if key and Interview.objects.filter(survey=survey.id,
+                                        session_key=key).exists():
         return HttpResponseRedirect(
             reverse('answers-detail', None, (),
-                    {'survey_slug': survey.slug,
-                     'key': request.session.session_key.lower()}))
+                    {'survey_slug': survey.slug, 'key': key}))
 
     # go to thank you page
     return render_to_response(template_name,
                               {'survey': survey, 'title': _('Thank You')},
                               context_instance=RequestContext(request))
 
+@timed_view
 def survey_detail(request, survey_slug,
                group_slug=None, group_slug_field=None, group_qs=None,
                template_name = 'survey/survey_detail.html',
@@ -79,36 +88,64 @@ def survey_detail(request, survey_slug,
             return HttpResponseRedirect(reverse('survey-results', None, (),
                                                 {'survey_slug': survey_slug}))
         raise Http404 #(_('Page not found.')) # unicode + exceptions = bad
-    # if user has a session and have answered some questions
-    # and the survey does not accept multiple answers,
-    # go ahead and redirect to the answers, or a thank you
-    if (hasattr(request, 'session') and
-        survey.has_answers_from(request.session.session_key) and
-        not survey.allows_multiple_interviews and not allow_edit_existing_answers):
+    # if the respondent cookie tells they answered the survey and the
+    # survey does not accept multiple answers, go ahead and redirect to the
+    # answers, or a thank you. Without the cookie no query is spent on it,
+    # the interview claimed when saving the answers refuses a second one.
+    respondent = get_respondent(request)
+    single = not survey.allows_multiple_interviews
+    if (single and not allow_edit_existing_answers and
+        respondent.answered is not None and respondent.has_answered(survey)):
         return _survey_redirect(request, survey,group_slug=group_slug)
     # if the survey is restricted to authentified user redirect
     # annonymous user to the login page
     if survey.restricted and str(request.user) == "AnonymousUser":
         return HttpResponseRedirect(reverse("auth_login")+"?next=%s" % request.path)
-    if request.POST and not hasattr(request, 'session'):
+    if request.POST and not respondent.key:
         return HttpResponse(unicode(_('Cookies must be enabled.')), status=403)
-    if hasattr(request, 'session'):
+    # The respondent cookie is only sent once they answered, so that
+    # browsing the surveys does not write the session.
+    if hasattr(request, 'session') and not cookie_enabled():
         skey = 'survey_%d' % survey.id
         request.session[skey] = (request.session.get(skey, False) or
                                  request.method == 'POST')
         request.session.modified = True ## enforce the cookie save.
-    survey.forms = forms_for_survey(survey, request, allow_edit_existing_answers)
-    if (request.POST and all(form.is_valid() for form in survey.forms)):
-        for form in survey.forms:
-            form.save()
-        return _survey_redirect(request, survey,group_slug=group_slug)
+    with phase(request, 'forms'):
+        survey.forms = forms_for_survey(survey, request,
+                                        allow_edit_existing_answers)
+        survey.forms_html = blank_forms_html(survey, survey.forms)
+        valid = request.POST and all(form.is_valid() for form in survey.forms)
+    if valid:
+        # The interviews of the surveys accepting a single one are claimed
+        # when saved, which the spool would defer.
+        with phase(request, 'save'):
+            if (spool.enabled() and not allow_edit_existing_answers and
+                not single):
+                spool.spool_answers(survey.forms)
+                outcome = 'spooled'
+            else:
+                try:
+                    metrics.answers_written.inc(
+                        save_answers(survey.forms, single),
+                        survey=survey.slug)
+                    outcome = 'saved'
+                except InterviewClaimed:
+                    outcome = 'refused'
+        metrics.submissions.inc(survey=survey.slug, outcome=outcome)
+        respondent.add_answered(survey)
+        return stick_to_primary(set_cookie(
+            _survey_redirect(request, survey,group_slug=group_slug),
+            respondent))
+    if request.POST:
+        metrics.validation_failures.inc(survey=survey.slug)
     # Redirect either to 'survey.template_name' if this attribute is set or
     # to the default template
-    return render_to_response(survey.template_name or template_name,
-                              {'survey': survey,
-                               'title': survey.title,
-                               'group_slug': group_slug},
-                              context_instance=RequestContext(request))
+    with phase(request, 'render'):
+        return render_to_response(survey.template_name or template_name,
+                                  {'survey': survey,
+                                   'title': survey.title,
+                                   'group_slug': group_slug},
+                                  context_instance=RequestContext(request))
 
 # TODO: ajaxify this page (jquery) : add a date picker, ...
 # TODO: Fix the bug that make the questions and the choices unordered
@@ -120,8 +157,17 @@ def survey_edit(request,survey_slug,
                extra_context=None,
                *args, **kw):
     survey = get_object_or_404(Survey, slug=survey_slug)
+    # The choices of every question in one query.
+    choices = {}
+    for choice in Choice.objects.filter(question__survey=survey)\
+            .order_by('order'):
+        choices.setdefault(choice.question_id, []).append(choice)
+    questions = list(survey.questions.order_by('order'))
+    for question in questions:
+        question.choice_list = choices.get(question.id, [])
     return render_to_response(template_name,
                               {'survey': survey,
+                               'questions': questions,
                                'group_slug': group_slug},
                               context_instance=RequestContext(request))
 
@@ -277,8 +323,7 @@ def question_delete(request,survey_slug,question_id,
     return delete_object(request, object_id=question_id,
         **{"model":Question,
          "post_delete_redirect": reverse("survey-edit",None,(),
-                                         {"survey_slug":survey_slug,
-                                          "group_slug":group_slug}),
+                                         {"survey_slug":survey_slug}),
          "template_object_name":"question",
          "login_required": True,
          'extra_context': {'title': _('Delete question')}
@@ -361,6 +406,8 @@ def choice_delete(request,survey_slug,choice_id,
         })
 
 
+@timed_view
+@reads_from_replica
 def visible_survey_list(request,
                         group_slug=None, group_slug_field=None, group_qs=None,
                         login_required = False,
@@ -372,7 +419,8 @@ def visible_survey_list(request,
         return redirect_to_login(request.path)
     else:
         return object_list(request,
-            **{ 'queryset': Survey.objects.filter(visible=True),
+            **{ 'queryset': Survey.objects.filter(visible=True)
+                                          .with_stats(request),
               'allow_empty': True,
               'template_name':template_name,
               'extra_context': {'title': _('Surveys')}}
@@ -389,7 +437,8 @@ def editable_survey_list(request,
 
     return object_list(request,
         **{ 'queryset': Survey.objects.filter(Q(created_by=login_user) |
-                                            Q(editable_by=login_user)),
+                                            Q(editable_by=login_user))
+                                      .with_stats(request),
           'allow_empty': True,
           'template_name':template_name,
           'extra_context': {'title': _('Surveys'),
@@ -398,6 +447,8 @@ def editable_survey_list(request,
             })
 
 
+@timed_view
+@reads_from_replica
 def answers_list(request, survey_slug,
                  group_slug=None, group_slug_field=None, group_qs=None,
                  template_name = 'survey/answers_list.html',
@@ -409,21 +460,70 @@ def answers_list(request, survey_slug,
     survey = get_object_or_404(Survey.objects.filter(visible=True), slug=survey_slug)
     # if the user lacks permissions, show an "Insufficient Permissions page"
     if not survey.answers_viewable_by(request.user):
-        if (hasattr(request, 'session') and
-            survey.has_answers_from(request.session.session_key)):
+        respondent = get_respondent(request)
+        if respondent.has_answered(survey):
             return HttpResponseRedirect(
                 reverse('answers-detail', None, (),
                         {'survey_slug': survey.slug,
-                         'key': request.session.session_key.lower()}))
+                         'key': respondent.key}))
         return HttpResponse(unicode(_('Insufficient Privileges.')), status=403)
-    return render_to_response(template_name,
-        { 'survey': survey,
-          'view_submissions': request.user.has_perm('survey.view_submissions'),
-          'title': survey.title + u' - ' + unicode(_('Results'))},
-        context_instance=RequestContext(request))
+    with phase(request, 'results'):
+        results = survey.cached_results()
+    with phase(request, 'render'):
+        return render_to_response(template_name,
+            { 'survey': survey,
+              'results': results,
+              'view_submissions': request.user.has_perm('survey.view_submissions'),
+              'title': survey.title + u' - ' + unicode(_('Results'))},
+            context_instance=RequestContext(request))
+
+
 
+@timed_view
+@reads_from_replica
+def results_json(request, survey_slug):
+    """
+    The answer counts of a survey as JSON. Given the ``since`` cursor of a
+    previous response, only the counts added since, see
+    ``Survey.results_since``.
+    """
+    survey = get_object_or_404(Survey.objects.filter(visible=True), slug=survey_slug)
+    if not survey.answers_viewable_by(request.user):
+        return HttpResponse(unicode(_('Insufficient Privileges.')), status=403)
+    return HttpResponse(simplejson.dumps(
+                            survey.results_since(request.GET.get('since'))),
+                        mimetype='application/json')
 
+@timed_view
+@reads_from_replica
+def answers_more(request, survey_slug, question_id,
+                 group_slug=None, group_slug_field=None, group_qs=None,
+                 template_name = 'survey/answers_page.html',
+                 extra_context=None,
+                 *args, **kw):
+    """
+    Shows the next page of the free text answers of a question, as a
+    fragment of the survey results page.
 
+    The page follows the ``after`` cursor and its answers are numbered from
+    ``start``.
+    """
+    survey = get_object_or_404(Survey.objects.filter(visible=True), slug=survey_slug)
+    if not survey.answers_viewable_by(request.user):
+        return HttpResponse(unicode(_('Insufficient Privileges.')), status=403)
+    question = get_object_or_404(survey.questions, id=question_id)
+    try:
+        question.answer_page(request.GET.get('after'),
+                             int(request.GET.get('start', 0)))
+    except ValueError:
+        raise Http404
+    return render_to_response(template_name,
+        {'survey': survey, 'question': question,
+         'view_submissions': request.user.has_perm('survey.view_submissions')},
+        context_instance=RequestContext(request))
+
+@timed_view
+@reads_from_replica
 def answers_detail(request, survey_slug, key,
                    group_slug=None, group_slug_field=None, group_qs=None,
                    template_name = 'survey/answers_detail.html',
@@ -434,13 +534,14 @@ def answers_detail(request, survey_slug, key,
 
     If the user lacks permissions, show an "Insufficient Permissions page".
     """
-    answers = Answer.objects.filter(session_key=key.lower(),
-        question__survey__visible=True, question__survey__slug=survey_slug)
-    if not answers.count(): raise Http404
-    survey = answers[0].question.survey
+    survey = get_object_or_404(Survey.objects.filter(visible=True),
+                               slug=survey_slug)
+    answers = list(Answer.objects.filter(interview__survey=survey.id,
+                                         interview__session_key=key.lower())
+                   .select_related('question'))
+    if not answers: raise Http404
 
-    mysubmission = (hasattr(request, 'session') and
-         request.session.session_key.lower() == key.lower())
+    mysubmission = get_respondent(request).key == key.lower()
 
     if (not mysubmission and
         (not request.user.has_perm('survey.view_submissions') or
@@ -451,6 +552,24 @@ def answers_detail(request, survey_slug, key,
          'title': survey.title + u' - ' + unicode(_('Submission'))},
         context_instance=RequestContext(request))
 
+def answers_export(request, survey_slug, format='csv',
+                   group_slug=None, group_slug_field=None, group_qs=None,
+                   *args, **kw):
+    """
+    Streams the answers of a survey with one row per interview.
+
+    If the user lacks permissions, show an "Insufficient Permissions page".
+    """
+    survey = get_object_or_404(Survey.objects.filter(visible=True), slug=survey_slug)
+    if (not request.user.has_perm('survey.view_submissions') or
+        not survey.answers_viewable_by(request.user)):
+        return HttpResponse(unicode(_('Insufficient Privileges.')), status=403)
+    export, mimetype = EXPORT_FORMATS[format]
+    response = HttpResponse(export(survey), mimetype=mimetype)
+    response['Content-Disposition'] = 'attachment; filename=%s.%s' % (
+        survey.slug, format)
+    return response
+
 def delete_image(request, model_string,object_id):
     model = models.get_model("survey", model_string)
     object = get_object_or_404(model, id=object_id)
@@ -467,3 +586,14 @@ def delete_image(request, model_string,object_id):
     return render_to_response('survey/image_confirm_delete.html',
         {"object" : object},
         context_instance=RequestContext(request))
+
+def metrics_view(request):
+    """
+    The survey metrics of this process in the Prometheus text exposition
+    format, for the INTERNAL_IPS and the staff.
+    """
+    if not (request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS or
+            request.user.is_staff):
+        return HttpResponse(unicode(_('Insufficient Privileges.')), status=403)
+    return HttpResponse(metrics.REGISTRY.exposition(),
+                        mimetype=metrics.CONTENT_TYPE)